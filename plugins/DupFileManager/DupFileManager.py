@@ -3,9 +3,14 @@
 # Get the latest developers version from following link: https://github.com/David-Maisonave/Axter-Stash/tree/main/plugins/DupFileManager
 # Note: To call this script outside of Stash, pass argument --url 
 #       Example:    python DupFileManager.py --url http://localhost:9999 -a
-import os, sys, time, pathlib, argparse, platform, shutil, logging
+import os, sys, stat, pathlib, argparse, platform, shutil, logging
+import concurrent.futures
 from StashPluginHelper import StashPluginHelper
 from DupFileManager_config import config # Import config from DupFileManager_config.py
+from DupFileManager_score import KeeperScorer
+from DupFileManager_verify import ContentVerifier
+from DupFileManager_work import DupWorkFile
+from DupFileManager_report import DupReport
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--url', '-u', dest='stash_url', type=str, help='Add Stash URL')
@@ -13,6 +18,7 @@ parser.add_argument('--trace', '-t', dest='trace', action='store_true', help='En
 parser.add_argument('--add_dup_tag', '-a', dest='dup_tag', action='store_true', help='Set a tag to duplicate files.')
 parser.add_argument('--del_tag_dup', '-d', dest='del_tag', action='store_true', help='Only delete scenes having DuplicateMarkForDeletion tag.')
 parser.add_argument('--remove_dup', '-r', dest='remove', action='store_true', help='Remove (delete) duplicate files.')
+parser.add_argument('--report', '-g', dest='report', action='store_true', help='Generate an HTML and JSON report of the duplicate files.')
 parse_args = parser.parse_args()
 
 settings = {
@@ -61,6 +67,26 @@ significantTimeDiff         = stash.Setting('significantTimeDiff')
 toRecycleBeforeSwap         = stash.Setting('toRecycleBeforeSwap')
 cleanAfterDel               = stash.Setting('zCleanAfterDel')
 duration_diff               = float(stash.Setting('duration_diff'))
+sceneBatchSize              = int(stash.Setting('sceneBatchSize', 500))
+tagBatchSize                = int(stash.Setting('tagBatchSize', 500))
+deleteWorkers               = int(stash.Setting('deleteWorkers', 4))
+verifyDupContent            = stash.Setting('verifyDupContent', False)
+verifyFullHash              = stash.Setting('verifyFullHash', True)
+verifyWorkers               = int(stash.Setting('verifyWorkers', 4))
+localPhashEngine            = stash.Setting('localPhashEngine', False)
+phashDistance               = int(stash.Setting('phashDistance', 0))
+phashIndexFile              = stash.Setting('phashIndexFile', "", notEmpty=True)
+dupWorkFile                 = stash.Setting('dupWorkFile', "", notEmpty=True)
+dupWorkFileMaxAge           = float(stash.Setting('dupWorkFileMaxAge', 72))
+dupSetChunkSize             = int(stash.Setting('dupSetChunkSize', 100))
+reportDir                   = stash.Setting('reportDir', "", notEmpty=True)
+reportWorkers               = int(stash.Setting('reportWorkers', 8))
+if dupWorkFile == "":
+    dupWorkFile = f"{stash.LOG_FILE_DIR}{os.sep}DupFileManager_work.json"
+if reportDir == "":
+    reportDir = f"{stash.LOG_FILE_DIR}{os.sep}DupFileManagerReport"
+if phashIndexFile == "":
+    phashIndexFile = f"{stash.LOG_FILE_DIR}{os.sep}DupFileManager_phash.npz"
 if duration_diff > 10:
     duration_diff = 10
 elif duration_diff < 1:
@@ -96,38 +122,91 @@ blacklist = stash.Setting('zyBlacklist').split(listSeparator)
 blacklist = [item.lower() for item in blacklist]
 if blacklist == [""] : blacklist = []
 stash.Trace(f"blacklist = {blacklist}")
+
+# Only the scene fields needed to pick the duplicate to keep, tag it, and merge metadata
+dupSceneFragment = "id updated_at paths{screenshot} title details date director code rating100 urls studio{id} tags{id name} performers{id} galleries{id} movies{movie{id} scene_index} files{path width height duration size}"
     
-def realpath(path):
+def resolveRealpath(path):
     """
     get_symbolic_target for win
     """
     try:
-        import win32file
+        import win32file, pywintypes
+    except ImportError:
+        return os.path.realpath(path)
+    try:
         f = win32file.CreateFile(path, win32file.GENERIC_READ,
                                  win32file.FILE_SHARE_READ, None,
                                  win32file.OPEN_EXISTING,
                                  win32file.FILE_FLAG_BACKUP_SEMANTICS, None)
+    except pywintypes.error: # Sharing violation or access denied. Called from PathResolutionCache.preResolve threads, so must not raise.
+        return os.path.realpath(path)
+    try:
         target = win32file.GetFinalPathNameByHandle(f, 0)
-        # an above gives us something like u'\\\\?\\C:\\tmp\\scalarizr\\3.3.0.7978'
-        return target.strip('\\\\?\\')
-    except ImportError:
-        handle = open_dir(path)
-        target = get_symbolic_target(handle)
-        check_closed(handle)
-        return target
+    except pywintypes.error:
+        return os.path.realpath(path)
+    finally:
+        f.Close()
+    # an above gives us something like u'\\\\?\\C:\\tmp\\scalarizr\\3.3.0.7978'
+    return target.strip('\\\\?\\')
+
+# Caches the resolved path, symbolic link and reparse point status of each path for the duration of the run.
+# An entry is only reused while the lstat of the path (device, inode and modification time) is unchanged,
+# so a path replaced during the run is resolved again.
+class PathResolutionCache:
+    entries = None
+    workers = 8
+
+    def __init__(self, workers=8):
+        self.entries = {}
+        self.workers = workers
+
+    def statKey(self, path):
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return None, None
+        return (st.st_dev, st.st_ino, st.st_mtime_ns), st
+
+    def get(self, path):
+        key, st = self.statKey(path)
+        entry = self.entries.get(path)
+        if entry != None and entry['key'] == key:
+            return entry
+        entry = {'key' : key, 'realpath' : resolveRealpath(path) if key != None else os.path.realpath(path), 'isLink' : st != None and stat.S_ISLNK(st.st_mode), 'attributes' : getattr(st, 'st_file_attributes', 0)}
+        self.entries[path] = entry
+        return entry
+
+    # Resolves all the paths at once in a thread pool. Used before processing duplicate sets, so network mounts are queried concurrently.
+    def preResolve(self, paths):
+        paths = [path for path in set(paths) if path not in self.entries]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self.get, paths))
+
+    def realpath(self, path):
+        return self.get(path)['realpath']
+
+    def isSymLink(self, path):
+        return self.get(path)['isLink']
+
+    def isReparsePoint(self, path):
+        entry = self.get(path)
+        if not os.path.isdir(path):
+            entry = self.get(os.path.dirname(path))
+        return (entry['attributes'] & getattr(stat, 'FILE_ATTRIBUTE_REPARSE_POINT', 0x400)) != 0
+
+pathCache = PathResolutionCache()
+
+def realpath(path):
+    return pathCache.realpath(path)
 
 def isReparsePoint(path):
-    import win32api
-    import win32con
-    from parse_reparsepoint import Navigator
     FinalPathname = realpath(path)
     stash.Log(f"(path='{path}') (FinalPathname='{FinalPathname}')")
-    if FinalPathname != path:
+    if FinalPathname != path or pathCache.isSymLink(path):
         stash.Log(f"Symbolic link '{path}'")
         return True
-    if not os.path.isdir(path):
-        path = os.path.dirname(path)
-    return win32api.GetFileAttributes(path) & win32con.FILE_ATTRIBUTE_REPARSE_POINT
+    return pathCache.isReparsePoint(path)
 
 def testReparsePointAndSymLink(merge=False, deleteDup=False):
     stash.Trace(f"Debug Tracing (platform.system()={platform.system()})")
@@ -198,25 +277,137 @@ def setTagId(tagId, tagName, sceneDetails, DupFileToKeep):
             doAddTag = False
             break
     if doAddTag:
-        dataDict.update({'tag_ids' : tagId})
+        # Tags are added with bulkSceneUpdate, tagBatchSize scenes at a time
+        pendingSceneTags.setdefault(tagId, []).append(sceneDetails['id'])
+        stash.Trace(f"[setTagId] Queued tag {tagName} for {sceneDetails['files'][0]['path']}", toAscii=True)
+        if len(pendingSceneTags[tagId]) >= tagBatchSize:
+            flushSceneTags(tagId)
     if details != "":
         dataDict.update({'details' : details})
     if dataDict != ORG_DATA_DICT:
         stash.update_scene(dataDict)
         stash.Trace(f"[setTagId] Updated {sceneDetails['files'][0]['path']} with metadata {dataDict}", toAscii=True)
-    else:
+    elif not doAddTag:
         stash.Trace(f"[setTagId] Nothing to update {sceneDetails['files'][0]['path']}.", toAscii=True)
 
+pendingSceneTags = {}
+def flushSceneTags(tagId=None):
+    for pendingTagId in [tagId] if tagId != None else list(pendingSceneTags.keys()):
+        sceneIDs = pendingSceneTags.pop(pendingTagId, [])
+        if len(sceneIDs) > 0:
+            stash.bulk_update_scene_tags(sceneIDs, [pendingTagId])
+            stash.Trace(f"[flushSceneTags] Added tag ID {pendingTagId} to {len(sceneIDs)} scenes")
+
+# Reserves a file name in alternateTrashCanPath by creating it with O_EXCL, so two deletion workers never move to the same file
+def reserveTrashCanPath(DupFileName, sceneId):
+    DupFileNameOnly = pathlib.Path(DupFileName).stem
+    destPath = f"{alternateTrashCanPath}{os.sep}{DupFileNameOnly}"
+    QtyTried = 0
+    while True:
+        try:
+            os.close(os.open(destPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return destPath
+        except FileExistsError:
+            QtyTried += 1
+            destPath = f"{alternateTrashCanPath}{os.sep}_{sceneId}_{QtyTried}_{DupFileNameOnly}"
+
+# Called from the deletion worker threads. Raises an exception if the file was not moved, so that its scene is not destroyed.
+def moveDupFile(DupFileName, sceneId):
+    if alternateTrashCanPath != "":
+        destPath = reserveTrashCanPath(DupFileName, sceneId)
+        try:
+            try:
+                os.replace(DupFileName, destPath) # Replaces the reserved file
+            except OSError:
+                shutil.move(DupFileName, destPath) # Different drive; copies over the reserved file
+        except Exception:
+            os.remove(destPath)
+            raise
+    elif moveToTrashCan:
+        if not sendToTrash(DupFileName):
+            raise OSError("Could not send file to the trash can.")
+
+# Destroys the scenes whose files have been moved by the deletion workers. destroy_scene is only called from the calling thread, one scene at a time.
+# Returns the quantity of scenes destroyed.
+def destroyMovedDups(pendingDeletes, wait=False):
+    done, notDone = concurrent.futures.wait(list(pendingDeletes.keys()), timeout=None if wait else 0)
+    QtyDeleted = 0
+    for future in done:
+        scene = pendingDeletes.pop(future)
+        DupFileName = scene['files'][0]['path']
+        try:
+            future.result()
+        except Exception as e:
+            stash.Error(f"Failed to move duplicate '{DupFileName}'. Scene not deleted. Error: {e}", toAscii=True)
+            continue
+        result = stash.destroy_scene(scene['id'], delete_file=True)
+        stash.Trace(f"destroy_scene result={result} for file {DupFileName}", toAscii=True)
+        QtyDeleted += 1
+    return QtyDeleted
+
+
+# The whitelist, graylist, and blacklist compiled into one trie of path components, so that checking a path
+# costs one step per folder in the path, no matter how long the lists are.
+# Paths are case-folded and both '\' and '/' are treated as separators.
+class PathListTrie:
+    def __init__(self):
+        self.root = self.newNode()
+    
+    def newNode(self):
+        # flags: lists containing this folder. partial: (prefix, flag) for list items not ending with a separator, which match
+        # any child name starting with prefix. E.g. "C:\Fav" matches "C:\Favorite\..." as the previous startswith check did.
+        return {'children' : {}, 'flags' : 0, 'partial' : []}
+    
+    def split(self, path):
+        return path.casefold().replace('\\', '/').split('/')
+    
+    def add(self, items, flag):
+        for item in items:
+            parts = self.split(item)
+            node = self.root
+            for part in parts[:-1]:
+                if part not in node['children']:
+                    node['children'][part] = self.newNode()
+                node = node['children'][part]
+            if parts[-1] == "":
+                node['flags'] |= flag
+            else:
+                node['partial'] += [(parts[-1], flag)]
+    
+    # Returns the flags of all the lists having an item which is a prefix of path
+    def lookup(self, path):
+        flags = 0
+        node = self.root
+        for part in self.split(path):
+            flags |= node['flags']
+            for prefix, flag in node['partial']:
+                if part.startswith(prefix):
+                    flags |= flag
+            node = node['children'].get(part)
+            if node == None:
+                break
+        return flags
+
+WHITELIST = 1
+GRAYLIST = 2
+BLACKLIST = 4
+pathLists = PathListTrie()
+pathLists.add(whitelist, WHITELIST)
+pathLists.add(graylist, GRAYLIST)
+pathLists.add(blacklist, BLACKLIST)
 
 def isInList(listToCk, pathToCk):
-    pathToCk = pathToCk.lower()
-    for item in listToCk:
-        if pathToCk.startswith(item):
-            return True
-    return False
+    return (pathLists.lookup(pathToCk) & listToCk) != 0
+
+try:
+    keeperScorer = KeeperScorer(lambda path: isInList(WHITELIST, path), lambda path: isInList(BLACKLIST, path), lambda path: isInList(GRAYLIST, path), weights=stash.Setting('keeperWeights', None))
+except ImportError as e:
+    stash.Warn(f"keeperWeights requires numpy ({e}). Ranking duplicates by resolution, duration, whitelist, blacklist, graylist, path length and size instead.")
+    keeperScorer = KeeperScorer(lambda path: isInList(WHITELIST, path), lambda path: isInList(BLACKLIST, path), lambda path: isInList(GRAYLIST, path))
+scoreReportFile = stash.Setting('scoreReportFile', "")
 
 def hasSameDir(path1, path2):
-    if pathlib.Path(path1).resolve().parent == pathlib.Path(path2).resolve().parent:
+    if os.path.dirname(realpath(path1)) == os.path.dirname(realpath(path2)):
         return True
     return False
 
@@ -246,7 +437,7 @@ def significantLessTime(durrationToKeep, durrationOther):
 
 def isSwapCandidate(DupFileToKeep, DupFile):
     # Don't move if both are in whitelist
-    if isInList(whitelist, DupFileToKeep['files'][0]['path']) and isInList(whitelist, DupFile['files'][0]['path']):
+    if isInList(WHITELIST, DupFileToKeep['files'][0]['path']) and isInList(WHITELIST, DupFile['files'][0]['path']):
         return False
     if swapHighRes and (int(DupFileToKeep['files'][0]['width']) > int(DupFile['files'][0]['width']) or int(DupFileToKeep['files'][0]['height']) > int(DupFile['files'][0]['height'])):
         if not significantLessTime(int(DupFileToKeep['files'][0]['duration']), int(DupFile['files'][0]['duration'])):
@@ -258,6 +449,58 @@ def isSwapCandidate(DupFileToKeep, DupFile):
             return True
     return False
 
+def findDupFileSetsLocally():
+    try:
+        from DupFileManager_phash import PhashIndex # Requirement: pip install numpy
+    except ImportError as e:
+        stash.Warn(f"Local phash engine requires numpy ({e}). Using Stash findDuplicateScenes instead.")
+        return None, None
+    phashIndex = PhashIndex(stash, phashIndexFile)
+    phashIndex.load()
+    phashIndex.update()
+    phashIndex.save()
+    stash.Log(f"Finding duplicates locally in {len(phashIndex.ids)} phashes; distance={phashDistance}; duration_diff={duration_diff}", printTo=LOG_STASH_N_PLUGIN)
+    return phashIndex, phashIndex.findDuplicates(distance=phashDistance, duration_diff=duration_diff)
+
+def findDupFileSets():
+    stash.Log(f"Waiting for find_duplicate_scenes_diff to return results; duration_diff={duration_diff}; significantTimeDiff={significantTimeDiff}", printTo=LOG_STASH_N_PLUGIN)
+    phashIndex = None
+    if localPhashEngine:
+        phashIndex, DupFileSets = findDupFileSetsLocally()
+    if phashIndex == None:
+        DupFileSets = stash.find_duplicate_scenes_diff(distance=phashDistance, duration_diff=duration_diff)
+    return phashIndex, DupFileSets
+
+# Fetches the scene details of dupSetChunkSize duplicate sets at a time, and yields each set with its scenes ranked by keeperScorer.
+# Ranked sets are also appended to AllRankedSets for the score report, and the content verification of each chunk is added to verifiedDups.
+def iterRankedSets(DupFileSets, phashIndex, verifyContent, verifiedDups, AllRankedSets):
+    for chunkStart in range(0, len(DupFileSets), dupSetChunkSize):
+        DupFileSetChunk = DupFileSets[chunkStart:chunkStart + dupSetChunkSize]
+        sceneIDs = [DupFile['id'] for DupFileSet in DupFileSetChunk for DupFile in DupFileSet]
+        Scenes = {Scene['id'] : Scene for Scene in stash.find_scenes_by_ids(sceneIDs, fragment=dupSceneFragment, batchSize=sceneBatchSize)}
+        if phashIndex != None and len(Scenes) < len(sceneIDs):
+            phashIndex.removeScenes([sceneID for sceneID in sceneIDs if sceneID not in Scenes]) # Scenes deleted since the phash index was updated
+            phashIndex.save()
+        DupSceneSets = []
+        for DupFileSet in DupFileSetChunk:
+            stash.Trace("DupFileSet=%s", logArgs=(DupFileSet,))
+            DupSceneSet = []
+            for DupFile in DupFileSet:
+                if DupFile['id'] not in Scenes:
+                    stash.Warn(f"Could not get scene data for scene ID {DupFile['id']}.")
+                    continue
+                DupSceneSet += [Scenes[DupFile['id']]]
+            DupSceneSets += [DupSceneSet]
+        pathCache.preResolve([Scene['files'][0]['path'] for DupSceneSet in DupSceneSets for Scene in DupSceneSet])
+        RankedSets = keeperScorer.rank(DupSceneSets)
+        if verifyContent:
+            verified = ContentVerifier(fullHash=verifyFullHash, workers=verifyWorkers).verifySets([(RankedSet[0]['scene']['files'][0]['path'], [Ranked['scene']['files'][0]['path'] for Ranked in RankedSet[1:]]) for RankedSet in RankedSets if len(RankedSet) > 1])
+            stash.Log(f"Verified content of {len(verified)} duplicates: {list(verified.values()).count(True)} exact duplicates", printTo=LOG_STASH_N_PLUGIN)
+            verifiedDups.update(verified)
+        AllRankedSets += RankedSets
+        for DupFileSet, RankedSet in zip(DupFileSetChunk, RankedSets):
+            yield DupFileSet, RankedSet
+
 def mangeDupFiles(merge=False, deleteDup=False, tagDuplicates=False):
     duplicateMarkForDeletion_descp = 'Tag added to duplicate scenes so-as to tag them for deletion.'
     stash.Trace(f"duplicateMarkForDeletion = {duplicateMarkForDeletion}")    
@@ -281,29 +524,45 @@ def mangeDupFiles(merge=False, deleteDup=False, tagDuplicates=False):
     QtySwap = 0
     QtyMerge = 0
     QtyDeleted = 0
+    QtyUnverified = 0
     stash.Log("#########################################################################")
     stash.Trace("#########################################################################")
-    stash.Log(f"Waiting for find_duplicate_scenes_diff to return results; duration_diff={duration_diff}; significantTimeDiff={significantTimeDiff}", printTo=LOG_STASH_N_PLUGIN)
-    DupFileSets = stash.find_duplicate_scenes_diff(duration_diff=duration_diff)
+    workFile = DupWorkFile(dupWorkFile, f"merge={merge}, deleteDup={deleteDup}, tagDuplicates={tagDuplicates}, phashDistance={phashDistance}, duration_diff={duration_diff}, localPhashEngine={localPhashEngine}", maxAge=dupWorkFileMaxAge)
+    phashIndex = None
+    if workFile.load():
+        stash.Log(f"Resuming duplicate sets saved in {dupWorkFile}; {len(workFile.done)} of {len(workFile.sets)} sets already processed", printTo=LOG_STASH_N_PLUGIN)
+    else:
+        phashIndex, DupFileSets = findDupFileSets()
+        workFile.start(DupFileSets)
+    DupFileSets = workFile.pendingSets()
     qtyResults = len(DupFileSets)
+    stash.Log(f"Processing {qtyResults} duplicate sets in chunks of {dupSetChunkSize}", printTo=LOG_STASH_N_PLUGIN)
+    verifiedDups = {}
+    AllRankedSets = []
+    deleteExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=deleteWorkers)
+    pendingDeletes = {}
     stash.Trace("#########################################################################")
-    for DupFileSet in DupFileSets:
-        stash.Trace(f"DupFileSet={DupFileSet}")
+    isComplete = True
+    for DupFileSet, RankedSet in iterRankedSets(DupFileSets, phashIndex, deleteDup and verifyDupContent, verifiedDups, AllRankedSets):
+        if QtyDupSet % dupSetChunkSize == 0 and QtyDupSet > 0:
+            QtyDeleted += destroyMovedDups(pendingDeletes, wait=True) # Only checkpoint sets whose duplicates are fully deleted
+            flushSceneTags() # and tagged, because a resumed run skips the sets marked done
+            workFile.save()
         QtyDupSet+=1
         stash.Progress(QtyDupSet, qtyResults)
         SepLine = "---------------------------"
-        DupFileToKeep = ""
-        DupToCopyFrom = ""
         DupFileDetailList = []
-        for DupFile in DupFileSet:
+        if len(RankedSet) == 0:
+            workFile.markDone(DupFileSet)
+            continue
+        DupFileToKeep = RankedSet[0]['scene']
+        for Ranked in RankedSet:
+            Scene = Ranked['scene']
             QtyDup+=1
-            stash.log.sl.progress(f"Scene ID = {DupFile['id']}")
-            time.sleep(2)
-            Scene = stash.find_scene(DupFile['id'])
-            sceneData = f"Scene = {Scene}"
-            stash.Trace(sceneData, toAscii=True)
+            stash.log.sl.progress(f"Scene ID = {Scene['id']}")
+            stash.Trace("Scene = %s", toAscii=True, logArgs=(Scene,))
             DupFileDetailList = DupFileDetailList + [Scene]
-            if DupFileToKeep != "":
+            if Scene['id'] != DupFileToKeep['id']:
                 if int(DupFileToKeep['files'][0]['duration']) == int(Scene['files'][0]['duration']): # Do not count fractions of a second as a difference
                     QtyExactDup+=1
                 else:
@@ -311,24 +570,7 @@ def mangeDupFiles(merge=False, deleteDup=False, tagDuplicates=False):
                     SepLine = "***************************"
                     if significantLessTime(int(DupFileToKeep['files'][0]['duration']), int(Scene['files'][0]['duration'])):
                         QtyRealTimeDiff += 1
-                if int(DupFileToKeep['files'][0]['width']) < int(Scene['files'][0]['width']) or int(DupFileToKeep['files'][0]['height']) < int(Scene['files'][0]['height']):
-                    DupFileToKeep = Scene
-                elif int(DupFileToKeep['files'][0]['duration']) < int(Scene['files'][0]['duration']):
-                    DupFileToKeep = Scene
-                elif isInList(whitelist, Scene['files'][0]['path']) and not isInList(whitelist, DupFileToKeep['files'][0]['path']):
-                    DupFileToKeep = Scene
-                elif isInList(blacklist, DupFileToKeep['files'][0]['path']) and not isInList(blacklist, Scene['files'][0]['path']):
-                    DupFileToKeep = Scene
-                elif isInList(graylist, Scene['files'][0]['path']) and not isInList(graylist, DupFileToKeep['files'][0]['path']):
-                    DupFileToKeep = Scene
-                elif len(DupFileToKeep['files'][0]['path']) < len(Scene['files'][0]['path']):
-                    DupFileToKeep = Scene
-                elif int(DupFileToKeep['files'][0]['size']) < int(Scene['files'][0]['size']):
-                    DupFileToKeep = Scene
-            else:
-                DupFileToKeep = Scene
-            # stash.Trace(f"DupFileToKeep = {DupFileToKeep}")
-            stash.Trace(f"KeepID={DupFileToKeep['id']}, ID={DupFile['id']} duration=({Scene['files'][0]['duration']}), Size=({Scene['files'][0]['size']}), Res=({Scene['files'][0]['width']} x {Scene['files'][0]['height']}) Name={Scene['files'][0]['path']}, KeepPath={DupFileToKeep['files'][0]['path']}", toAscii=True)
+            stash.Trace(lambda: f"KeepID={DupFileToKeep['id']}, ID={Scene['id']} Score={Ranked['score']:.3f} duration=({Scene['files'][0]['duration']}), Size=({Scene['files'][0]['size']}), Res=({Scene['files'][0]['width']} x {Scene['files'][0]['height']}) Name={Scene['files'][0]['path']}, KeepPath={DupFileToKeep['files'][0]['path']}", toAscii=True)
         
         for DupFile in DupFileDetailList:
             if DupFile['id'] != DupFileToKeep['id']:
@@ -337,7 +579,7 @@ def mangeDupFiles(merge=False, deleteDup=False, tagDuplicates=False):
                     if result != "Nothing To Merge":
                         QtyMerge += 1
                 
-                if isInList(whitelist, DupFile['files'][0]['path']) and (not whitelistDelDupInSameFolder or not hasSameDir(DupFile['files'][0]['path'], DupFileToKeep['files'][0]['path'])):
+                if isInList(WHITELIST, DupFile['files'][0]['path']) and (not whitelistDelDupInSameFolder or not hasSameDir(DupFile['files'][0]['path'], DupFileToKeep['files'][0]['path'])):
                     if isSwapCandidate(DupFileToKeep, DupFile):
                         if merge:
                             stash.merge_metadata(DupFileToKeep, DupFile)
@@ -353,19 +595,16 @@ def mangeDupFiles(merge=False, deleteDup=False, tagDuplicates=False):
                             setTagId(dupWhitelistTagId, duplicateWhitelistTag, DupFile, DupFileToKeep)
                     QtySkipForDel+=1
                 else:
-                    if deleteDup:
+                    if deleteDup and verifyDupContent and verifiedDups.get(DupFile['files'][0]['path']) != True:
+                        stash.Warn(f"NOT deleting duplicate, because its content does not match '{DupFileToKeep['files'][0]['path']}'. '{DupFile['files'][0]['path']}'", toAscii=True, printTo=LOG_STASH_N_PLUGIN)
+                        QtyUnverified += 1
+                        if tagDuplicates:
+                            setTagId(dupTagId, duplicateMarkForDeletion, DupFile, DupFileToKeep)
+                    elif deleteDup:
                         DupFileName = DupFile['files'][0]['path']
-                        DupFileNameOnly = pathlib.Path(DupFileName).stem
                         stash.Warn(f"Deleting duplicate '{DupFileName}'", toAscii=True, printTo=LOG_STASH_N_PLUGIN)
-                        if alternateTrashCanPath != "":
-                            destPath = f"{alternateTrashCanPath }{os.sep}{DupFileNameOnly}"
-                            if os.path.isfile(destPath):
-                                destPath = f"{alternateTrashCanPath }{os.sep}_{time.time()}_{DupFileNameOnly}"
-                            shutil.move(DupFileName, destPath)
-                        elif moveToTrashCan:
-                            sendToTrash(DupFileName)
-                        stash.destroy_scene(DupFile['id'], delete_file=True)
-                        QtyDeleted += 1
+                        pendingDeletes[deleteExecutor.submit(moveDupFile, DupFileName, DupFile['id'])] = DupFile
+                        QtyDeleted += destroyMovedDups(pendingDeletes)
                     elif tagDuplicates:
                         if QtyTagForDel == 0:
                             stash.Log(f"Tagging duplicate {DupFile['files'][0]['path']} for deletion with tag {duplicateMarkForDeletion}.", toAscii=True, printTo=LOG_STASH_N_PLUGIN)
@@ -374,10 +613,23 @@ def mangeDupFiles(merge=False, deleteDup=False, tagDuplicates=False):
                         setTagId(dupTagId, duplicateMarkForDeletion, DupFile, DupFileToKeep)
                     QtyTagForDel+=1
         stash.Trace(SepLine)
+        workFile.markDone(DupFileSet)
         if maxDupToProcess > 0 and QtyDup > maxDupToProcess:
+            isComplete = QtyDupSet == qtyResults
             break
     
-    stash.Log(f"QtyDupSet={QtyDupSet}, QtyDup={QtyDup}, QtyDeleted={QtyDeleted}, QtySwap={QtySwap}, QtyTagForDel={QtyTagForDel}, QtySkipForDel={QtySkipForDel}, QtyExactDup={QtyExactDup}, QtyAlmostDup={QtyAlmostDup}, QtyMerge={QtyMerge}, QtyRealTimeDiff={QtyRealTimeDiff}", printTo=LOG_STASH_N_PLUGIN)
+    QtyDeleted += destroyMovedDups(pendingDeletes, wait=True)
+    deleteExecutor.shutdown()
+    flushSceneTags()
+    if isComplete:
+        workFile.finish()
+    else:
+        workFile.save()
+        stash.Log(f"Stopped after {QtyDupSet} of {qtyResults} duplicate sets. The next run resumes from the remaining sets.", printTo=LOG_STASH_N_PLUGIN)
+    if scoreReportFile != "":
+        keeperScorer.writeReport(scoreReportFile, AllRankedSets)
+        stash.Log(f"Wrote duplicate scores to {scoreReportFile}", printTo=LOG_STASH_N_PLUGIN)
+    stash.Log(f"QtyDupSet={QtyDupSet}, QtyDup={QtyDup}, QtyDeleted={QtyDeleted}, QtyUnverified={QtyUnverified}, QtySwap={QtySwap}, QtyTagForDel={QtyTagForDel}, QtySkipForDel={QtySkipForDel}, QtyExactDup={QtyExactDup}, QtyAlmostDup={QtyAlmostDup}, QtyMerge={QtyMerge}, QtyRealTimeDiff={QtyRealTimeDiff}", printTo=LOG_STASH_N_PLUGIN)
     if cleanAfterDel:
         stash.Log("Adding clean jobs to the Task Queue", printTo=LOG_STASH_N_PLUGIN)
         stash.metadata_clean(paths=stash.STASH_PATHS)
@@ -395,36 +647,36 @@ def deleteTagggedDuplicates():
     QtyDeleted = 0
     QtyFailedQuery = 0
     stash.Trace("#########################################################################")
-    sceneIDs = stash.find_scenes(f={"tags": {"value":tagId, "modifier":"INCLUDES"}}, fragment='id')
-    qtyResults = len(sceneIDs)
-    stash.Trace(f"Found {qtyResults} scenes with tag ({duplicateMarkForDeletion}): sceneIDs = {sceneIDs}")
-    for sceneID in sceneIDs:
-        # stash.Trace(f"Getting scene data for scene ID {sceneID['id']}.")
-        QtyDup += 1
-        prgs = QtyDup / qtyResults
-        stash.Progress(QtyDup, qtyResults)
-        scene = stash.find_scene(sceneID['id'])
-        if scene == None or len(scene) == 0:
-            stash.Warn(f"Could not get scene data for scene ID {sceneID['id']}.")
-            QtyFailedQuery += 1
-            continue
-        # stash.Log(f"scene={scene}")
-        DupFileName = scene['files'][0]['path']
-        DupFileNameOnly = pathlib.Path(DupFileName).stem
-        stash.Warn(f"Deleting duplicate '{DupFileName}'", toAscii=True, printTo=LOG_STASH_N_PLUGIN)
-        if alternateTrashCanPath != "":
-            destPath = f"{alternateTrashCanPath }{os.sep}{DupFileNameOnly}"
-            if os.path.isfile(destPath):
-                destPath = f"{alternateTrashCanPath }{os.sep}_{time.time()}_{DupFileNameOnly}"
-            shutil.move(DupFileName, destPath)
-        elif moveToTrashCan:
-            sendToTrash(DupFileName)
-        result = stash.destroy_scene(scene['id'], delete_file=True)
-        stash.Trace(f"destroy_scene result={result} for file {DupFileName}", toAscii=True)
-        QtyDeleted += 1
+    scenes = stash.find_scenes(f={"tags": {"value":tagId, "modifier":"INCLUDES"}}, fragment='id files{path}')
+    qtyResults = len(scenes)
+    stash.Trace(f"Found {qtyResults} scenes with tag ({duplicateMarkForDeletion}): sceneIDs = {[scene['id'] for scene in scenes]}")
+    pendingDeletes = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=deleteWorkers) as deleteExecutor:
+        for scene in scenes:
+            QtyDup += 1
+            if len(scene['files']) == 0:
+                stash.Warn(f"Could not get file data for scene ID {scene['id']}.")
+                QtyFailedQuery += 1
+                continue
+            DupFileName = scene['files'][0]['path']
+            stash.Warn(f"Deleting duplicate '{DupFileName}'", toAscii=True, printTo=LOG_STASH_N_PLUGIN)
+            pendingDeletes[deleteExecutor.submit(moveDupFile, DupFileName, scene['id'])] = scene
+        while len(pendingDeletes) > 0:
+            concurrent.futures.wait(list(pendingDeletes.keys()), return_when=concurrent.futures.FIRST_COMPLETED)
+            QtyDeleted += destroyMovedDups(pendingDeletes)
+            stash.Progress(QtyDeleted + QtyFailedQuery, qtyResults)
     stash.Log(f"QtyDup={QtyDup}, QtyDeleted={QtyDeleted}, QtyFailedQuery={QtyFailedQuery}", printTo=LOG_STASH_N_PLUGIN)
     return
 
+def generateReport():
+    phashIndex, DupFileSets = findDupFileSets()
+    stash.Log(f"Generating report of {len(DupFileSets)} duplicate sets in {reportDir}", printTo=LOG_STASH_N_PLUGIN)
+    verifiedDups = {}
+    RankedSets = [RankedSet for DupFileSet, RankedSet in iterRankedSets(DupFileSets, phashIndex, verifyDupContent, verifiedDups, [])]
+    report = DupReport(reportDir, serverConnection=stash.FRAGMENT_SERVER, apiKey=stash.API_KEY, workers=reportWorkers)
+    reportFile = report.write(RankedSets, stash.STASH_URL, verifiedDups)
+    stash.Log(f"Wrote duplicate report {reportFile}; screenshots downloaded={report.QtyDownloaded}, cached={report.QtyCached}, failed={report.QtyFailed}", printTo=LOG_STASH_N_PLUGIN)
+
 def testSetDupTagOnScene(sceneId):
     scene = stash.find_scene(sceneId)
     stash.Log(f"scene={scene}")
@@ -444,6 +696,9 @@ elif stash.PLUGIN_TASK_NAME == "delete_tagged_duplicates_task":
 elif stash.PLUGIN_TASK_NAME == "delete_duplicates_task":
     mangeDupFiles(deleteDup=True, merge=mergeDupFilename)
     stash.Trace(f"{stash.PLUGIN_TASK_NAME} EXIT")
+elif stash.PLUGIN_TASK_NAME == "generate_report_task":
+    generateReport()
+    stash.Trace(f"{stash.PLUGIN_TASK_NAME} EXIT")
 elif parse_args.dup_tag:
     mangeDupFiles(tagDuplicates=True, merge=mergeDupFilename)
     stash.Trace(f"Tag duplicate EXIT")
@@ -453,6 +708,9 @@ elif parse_args.del_tag:
 elif parse_args.remove:
     mangeDupFiles(deleteDup=True, merge=mergeDupFilename)
     stash.Trace(f"Delete duplicate EXIT")
+elif parse_args.report:
+    generateReport()
+    stash.Trace(f"Generate report EXIT")
 else:
     stash.Log(f"Nothing to do!!! (PLUGIN_ARGS_MODE={stash.PLUGIN_TASK_NAME})")
 
@@ -10,6 +10,41 @@ config = {
     "significantTimeDiff" : .90, # 90% threshold
     # Valued passed to stash API function FindDuplicateScenes.
     "duration_diff" : 10, # (default=10) A value from 1 to 10.
+    # Number of scenes fetched per findScenes call when getting the details of the duplicate scenes.
+    "sceneBatchSize" : 500,
+    # Number of scenes tagged per bulkSceneUpdate call when tagging duplicates.
+    "tagBatchSize" : 500,
+    # Number of threads moving duplicate files to the trash can (or dup_path) at the same time when deleting duplicates.
+    "deleteWorkers" : 4,
+    # If enabled, duplicates are only deleted when their content is identical to the duplicate being kept. Other duplicates are tagged instead (when tagging is enabled).
+    # Files are compared by size and sampled blocks, and only files with matching samples are fully hashed.
+    "verifyDupContent" : False,
+    # If disabled, files with matching size and sampled blocks are considered identical without hashing the whole file.
+    "verifyFullHash" : True,
+    # Number of duplicate sets verified at the same time.
+    "verifyWorkers" : 4,
+    # File where the duplicate sets of a run are saved, so a run stopped early (zyMaxDupToProcess) resumes on the next run. If empty, DupFileManager_work.json in the plugin folder.
+    "dupWorkFile" : "",
+    # Hours before saved duplicate sets are considered stale and duplicates are searched again. 0 = No limit
+    "dupWorkFileMaxAge" : 72,
+    # Number of duplicate sets fetched, scored and checkpointed at a time.
+    "dupSetChunkSize" : 100,
+    # If enabled, find duplicates with a local phash index instead of Stash's findDuplicateScenes. Requires numpy.
+    "localPhashEngine" : False,
+    # Maximum phash distance between duplicates. 0=Exact, 4=High, 8=Medium, 10=Low
+    "phashDistance" : 0,
+    # File where the local phash index is saved. If empty, DupFileManager_phash.npz in the plugin folder.
+    "phashIndexFile" : "",
+    # Weights used to score which duplicate to keep. Each value is compared relative to the best value in the duplicate set.
+    # When empty, duplicates are ordered by resolution, then duration, whitelist, blacklist, graylist, path length, and size, where each only breaks ties of the previous ones.
+    # Missing entries use the defaults: resolution=1000, duration=100, whitelist=50, blacklist=-25, graylist=10, pathLength=2, size=1
+    "keeperWeights" : {},
+    # If not empty, a CSV file where the score of each duplicate is written for auditing. Example: "C:\\DupFileManager_scores.csv"
+    "scoreReportFile" : "",
+    # Folder where the Generate Duplicate Report task writes DupFileManager_report.html, DupFileManager_report.json and the screenshots. If empty, DupFileManagerReport in the plugin folder.
+    "reportDir" : "",
+    # Number of screenshots downloaded at the same time by the Generate Duplicate Report task.
+    "reportWorkers" : 8,
     # If enabled, moves destination file to recycle bin before swapping Hi-Res file.
     "toRecycleBeforeSwap" : True,
     # Character used to seperate items on the whitelist, blacklist, and graylist
@@ -19,6 +54,9 @@ config = {
     # Tag name used to tag duplicates in the whitelist. E.g. DuplicateWhitelistFile
     "DupWhiteListTag" : "DuplicateWhitelistFile",
     
+    # Seconds the Stash configuration fetched at startup is saved and shared with the other plugins using StashPluginHelper (FileMonitor, DupFileManager, RenameFile). The saved copy includes the Stash API key. 0 = Disabled
+    "configSnapshotTTL" : 0,
+    
     # The following fields are ONLY used when running DupFileManager in script mode
     "endpoint_Scheme" : "http", # Define endpoint to use when contacting the Stash server
     "endpoint_Host" : "0.0.0.0", # Define endpoint to use when contacting the Stash server
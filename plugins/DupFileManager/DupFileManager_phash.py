@@ -0,0 +1,184 @@
+# Description: Local perceptual hash (phash) duplicate finder used by DupFileManager when localPhashEngine is enabled.
+# The phash of every scene is kept in NumPy arrays which are saved to disk, so later runs only fetch scenes updated since the previous run.
+# Duplicates are found using multi-index hashing. The 64 bit phash is split into (distance + 1) chunks, and any two
+# hashes within the Hamming distance must have at least one identical chunk. So only scenes sharing a chunk value are compared.
+# The comparisons of all buckets, and the merging of the matching pairs into duplicate sets, are vectorised with NumPy.
+# Requires numpy. DupFileManager only imports this module when localPhashEngine is enabled.
+import os
+from datetime import datetime, timedelta
+import numpy
+
+if hasattr(numpy, "bitwise_count"): # NumPy >= 2.0
+    popcount = numpy.bitwise_count
+else:
+    _BITS_IN_BYTE = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint8)
+    def popcount(values):
+        values = numpy.ascontiguousarray(values, dtype=numpy.uint64)
+        return _BITS_IN_BYTE[values.view(numpy.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+class PhashIndex:
+    SCENE_FRAGMENT = "id updated_at files{duration fingerprints{type value}}"
+    stash = None
+    indexFile = None
+    pageSize = 5000
+    ids = None
+    hashes = None
+    durations = None
+    updatedAt = None # Latest scene updated_at seen. Used to only fetch changed scenes on the next run.
+    noPhash = None # IDs of scenes without a phash. Generating a phash does not change the scene updated_at, so these are fetched again on every update.
+
+    def __init__(self, stash, indexFile, pageSize=5000):
+        self.stash = stash
+        self.indexFile = indexFile
+        self.pageSize = pageSize
+        self.ids = numpy.zeros(0, dtype=numpy.int64)
+        self.hashes = numpy.zeros(0, dtype=numpy.uint64)
+        self.durations = numpy.zeros(0, dtype=numpy.float64)
+        self.noPhash = numpy.zeros(0, dtype=numpy.int64)
+
+    def load(self):
+        if not os.path.isfile(self.indexFile):
+            return False
+        try:
+            with numpy.load(self.indexFile) as data:
+                self.ids = data['ids']
+                self.hashes = data['hashes']
+                self.durations = data['durations']
+                self.updatedAt = str(data['updated_at']) if data['updated_at'].size else None
+                if 'no_phash' in data:
+                    self.noPhash = data['no_phash']
+                else:
+                    self.updatedAt = None # Index saved without the scenes lacking a phash. Fetch all scenes once to find them.
+        except Exception as e:
+            self.stash.Warn(f"Could not load phash index {self.indexFile}, rebuilding it. Error: {e}")
+            self.__init__(self.stash, self.indexFile, self.pageSize)
+            return False
+        self.stash.Trace(f"Loaded {len(self.ids)} phashes and {len(self.noPhash)} scenes without phash from {self.indexFile} (updatedAt={self.updatedAt})")
+        return True
+
+    def save(self):
+        tmpFile = f"{self.indexFile}.tmp.npz"
+        updatedAt = numpy.array(self.updatedAt if self.updatedAt else [], dtype=str)
+        numpy.savez(tmpFile, ids=self.ids, hashes=self.hashes, durations=self.durations, updated_at=updatedAt, no_phash=self.noPhash)
+        os.replace(tmpFile, self.indexFile)
+
+    # Fetch the phash of all scenes updated since the last update, and of the scenes which had no phash on the last update
+    def update(self):
+        sceneFilter = {}
+        if self.updatedAt:
+            sceneFilter["updated_at"] = {"value": self.watermark(), "modifier": "GREATER_THAN"}
+        ids = []
+        hashes = []
+        durations = []
+        noPhash = []
+        def addScene(scene):
+            sceneID = int(scene['id'])
+            phash = None
+            if len(scene['files']) > 0:
+                for fingerprint in scene['files'][0]['fingerprints']:
+                    if fingerprint['type'] == "phash":
+                        phash = fingerprint['value']
+                        break
+            if phash == None:
+                noPhash.append(sceneID)
+                return
+            ids.append(sceneID)
+            hashes.append(int(phash, 16))
+            durations.append(float(scene['files'][0]['duration'] or 0))
+        # Scenes updated while paging can be returned twice, so keep the last copy of each scene
+        changedScenes = {}
+        for scene in self.stash.iter_scenes(f=sceneFilter, fragment=self.SCENE_FRAGMENT, page_size=self.pageSize):
+            if self.updatedAt == None or scene['updated_at'] > self.updatedAt:
+                self.updatedAt = scene['updated_at']
+            changedScenes[int(scene['id'])] = scene
+        for scene in changedScenes.values():
+            addScene(scene)
+        seenIDs = set(changedScenes)
+        retryIDs = [int(sceneID) for sceneID in self.noPhash if int(sceneID) not in seenIDs]
+        for scene in self.findScenes(retryIDs):
+            addScene(scene)
+        self.stash.Log(f"Phash index update: {len(seenIDs)} new or changed scenes, {len(ids)} phashes added or updated, {len(noPhash)} scenes without phash")
+        if len(retryIDs) > 0:
+            self.stash.Trace(f"Rechecked {len(retryIDs)} scenes which had no phash on the last update")
+        self.removeScenes(ids + noPhash)
+        self.ids = numpy.concatenate((self.ids, numpy.array(ids, dtype=numpy.int64)))
+        self.hashes = numpy.concatenate((self.hashes, numpy.array(hashes, dtype=numpy.uint64)))
+        self.durations = numpy.concatenate((self.durations, numpy.array(durations, dtype=numpy.float64)))
+        self.noPhash = numpy.array(sorted(noPhash), dtype=numpy.int64)
+
+    # updated_at only has a precision of one second, so scenes updated in the same second as the last scene fetched are only
+    # found by querying from one second earlier. Scenes fetched again are replaced in the index.
+    def watermark(self):
+        try:
+            updatedAt = datetime.fromisoformat(self.updatedAt.replace("Z", "+00:00"))
+        except ValueError:
+            return self.updatedAt
+        return (updatedAt - timedelta(seconds=1)).isoformat()
+
+    # Fetch scenes by ID, pageSize at a time. Deleted scenes are not returned.
+    def findScenes(self, sceneIDs):
+        query = "query FindScenes($ids: [ID!]) { findScenes(ids: $ids, filter: {per_page: -1}) { scenes { %s } } }" % self.SCENE_FRAGMENT
+        for start in range(0, len(sceneIDs), self.pageSize):
+            result = self.stash.call_GQL(query, {"ids": [str(sceneID) for sceneID in sceneIDs[start:start + self.pageSize]]})
+            for scene in result['findScenes']['scenes']:
+                yield scene
+
+    def removeScenes(self, sceneIDs):
+        if len(sceneIDs) == 0 or len(self.ids) == 0:
+            return
+        keep = numpy.isin(self.ids, numpy.array([int(sceneID) for sceneID in sceneIDs], dtype=numpy.int64), invert=True)
+        self.ids = self.ids[keep]
+        self.hashes = self.hashes[keep]
+        self.durations = self.durations[keep]
+
+    # Returns duplicate sets in the same format as StashPluginHelper.find_duplicate_scenes_diff (list of lists of {'id': sceneID})
+    def findDuplicates(self, distance=0, duration_diff=10.0):
+        qty = len(self.ids)
+        pairsI = [numpy.zeros(0, dtype=numpy.int64)]
+        pairsJ = [numpy.zeros(0, dtype=numpy.int64)]
+        bounds = numpy.linspace(0, 64, distance + 2).astype(int)
+        for chunk in range(distance + 1):
+            width = bounds[chunk + 1] - bounds[chunk]
+            mask = numpy.uint64((1 << int(width)) - 1)
+            keys = (self.hashes >> numpy.uint64(bounds[chunk])) & mask
+            order = numpy.argsort(keys, kind='stable')
+            sortedKeys = keys[order]
+            starts = numpy.flatnonzero(numpy.r_[True, sortedKeys[1:] != sortedKeys[:-1]])
+            ends = numpy.r_[starts[1:], qty]
+            bucketEnds = numpy.repeat(ends, ends - starts) # End of the bucket of each sorted position
+            # Compare every position with the one offset positions later, in all buckets larger than offset at once
+            positions = numpy.flatnonzero(bucketEnds - numpy.arange(qty) > 1)
+            offset = 1
+            while len(positions) > 0:
+                i, j = order[positions], order[positions + offset]
+                close = popcount(self.hashes[i] ^ self.hashes[j]) <= distance
+                close &= numpy.abs(self.durations[i] - self.durations[j]) <= duration_diff
+                pairsI.append(i[close])
+                pairsJ.append(j[close])
+                offset += 1
+                positions = positions[bucketEnds[positions] - positions > offset]
+        labels = self.linkPairs(qty, numpy.concatenate(pairsI), numpy.concatenate(pairsJ))
+
+        sizes = numpy.bincount(labels, minlength=qty)
+        members = numpy.flatnonzero(sizes[labels] > 1)
+        if len(members) == 0:
+            return []
+        members = members[numpy.argsort(labels[members], kind='stable')]
+        setStarts = numpy.flatnonzero(labels[members][1:] != labels[members][:-1]) + 1
+        return [[{'id': str(sceneID)} for sceneID in dupSet] for dupSet in numpy.split(self.ids[members], setStarts)]
+
+    # Returns the connected component label of each index, which is the lowest index of its component.
+    # Each pass hooks the larger root of every pair still in different components onto the smaller root, then compresses the paths.
+    def linkPairs(self, qty, pairsI, pairsJ):
+        labels = numpy.arange(qty)
+        while len(pairsI) > 0:
+            rootsI, rootsJ = labels[pairsI], labels[pairsJ]
+            linked = rootsI != rootsJ
+            pairsI, pairsJ, rootsI, rootsJ = pairsI[linked], pairsJ[linked], rootsI[linked], rootsJ[linked]
+            numpy.minimum.at(labels, numpy.maximum(rootsI, rootsJ), numpy.minimum(rootsI, rootsJ))
+            while True:
+                parents = labels[labels]
+                if numpy.array_equal(parents, labels):
+                    break
+                labels = parents
+        return labels
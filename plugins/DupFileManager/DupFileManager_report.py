@@ -0,0 +1,118 @@
+# Description: Writes an HTML and JSON report of the duplicate sets found by DupFileManager, so the duplicates can be reviewed before deleting them.
+# Each set lists the duplicate to keep first, with the score and file details of every duplicate.
+# Screenshots are downloaded once in a thread pool, and cached in the report folder by scene ID and updated_at.
+# Re-generating the report only downloads the screenshots of new or changed scenes.
+import os, re, json, html, time
+import concurrent.futures
+from threading import Lock
+import requests
+
+class DupReport:
+    reportDir = None
+    thumbDir = None
+    session = None # Shared by the download threads, and authenticated like stashapi with the plugin's session cookie and API key
+    workers = 8
+    timeout = 30
+    QtyDownloaded = 0
+    QtyCached = 0
+    QtyFailed = 0
+    lock = None # Guards the Qty counters, which are updated from the download threads
+
+    def __init__(self, reportDir, serverConnection=None, apiKey=None, workers=8):
+        self.reportDir = reportDir
+        self.thumbDir = os.path.join(reportDir, "thumbs")
+        self.workers = workers
+        self.session = requests.Session()
+        if serverConnection == None:
+            serverConnection = {}
+        sessionCookie = serverConnection.get('SessionCookie')
+        if sessionCookie and sessionCookie.get('Value'):
+            self.session.cookies.set(sessionCookie['Name'], sessionCookie['Value'])
+        apiKey = serverConnection.get('ApiKey') or apiKey
+        if apiKey:
+            self.session.headers.update({"ApiKey": apiKey})
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+        self.lock = Lock()
+        os.makedirs(self.thumbDir, exist_ok=True)
+
+    def thumbName(self, scene):
+        return f"{scene['id']}_{re.sub(r'[^0-9A-Za-z]', '', scene.get('updated_at', ''))}.jpg"
+
+    # Downloads the screenshot of a scene if it is not cached. Returns the thumbnail file name relative to the report folder, or None on failure.
+    def fetchThumbnail(self, scene):
+        thumbFile = os.path.join(self.thumbDir, self.thumbName(scene))
+        if os.path.isfile(thumbFile):
+            with self.lock:
+                self.QtyCached += 1
+            return os.path.relpath(thumbFile, self.reportDir)
+        screenshot = scene.get('paths', {}).get('screenshot')
+        if not screenshot:
+            with self.lock:
+                self.QtyFailed += 1
+            return None
+        try:
+            response = self.session.get(screenshot, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            with self.lock:
+                self.QtyFailed += 1
+            return None
+        with open(f"{thumbFile}.tmp", 'wb') as f:
+            f.write(response.content)
+        os.replace(f"{thumbFile}.tmp", thumbFile)
+        with self.lock:
+            self.QtyDownloaded += 1
+        return os.path.relpath(thumbFile, self.reportDir)
+
+    # Removes the cached screenshots of scenes which changed (older updated_at) or are no longer duplicates
+    def removeStaleThumbnails(self, scenes):
+        current = {self.thumbName(scene) for scene in scenes}
+        for fileName in os.listdir(self.thumbDir):
+            if fileName.endswith(".jpg") and fileName not in current:
+                os.remove(os.path.join(self.thumbDir, fileName))
+
+    def fetchThumbnails(self, scenes):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return dict(zip([scene['id'] for scene in scenes], executor.map(self.fetchThumbnail, scenes)))
+
+    # rankedSets is the output of KeeperScorer.rank. verifiedDups is the optional output of ContentVerifier.verifySets.
+    def write(self, rankedSets, stashUrl, verifiedDups=None):
+        scenes = [ranked['scene'] for rankedSet in rankedSets for ranked in rankedSet]
+        thumbs = self.fetchThumbnails(scenes)
+        self.removeStaleThumbnails(scenes)
+        report = {'generated': time.strftime("%Y-%m-%d %H:%M:%S"), 'sets': []}
+        for rankedSet in rankedSets:
+            if len(rankedSet) == 0:
+                continue
+            dupSet = []
+            for rankNo, ranked in enumerate(rankedSet):
+                scene = ranked['scene']
+                file = scene['files'][0]
+                dupSet += [{'id': scene['id'], 'keep': rankNo == 0, 'score': round(ranked['score'], 3), 'path': file['path'],
+                            'width': file['width'], 'height': file['height'], 'duration': file['duration'], 'size': file['size'],
+                            'exactDup': verifiedDups.get(file['path']) if verifiedDups and rankNo > 0 else None,
+                            'url': f"{stashUrl}/scenes/{scene['id']}", 'thumbnail': thumbs.get(scene['id'])}]
+            report['sets'] += [dupSet]
+        with open(os.path.join(self.reportDir, "DupFileManager_report.json"), 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        with open(os.path.join(self.reportDir, "DupFileManager_report.html"), 'w', encoding='utf-8') as f:
+            f.write(self.toHtml(report))
+        return os.path.join(self.reportDir, "DupFileManager_report.html")
+
+    def toHtml(self, report):
+        lines = ["<!DOCTYPE html>", "<html><head><meta charset='utf-8'><title>DupFileManager Report</title>",
+                 "<style>body{font-family:sans-serif} table{border-collapse:collapse;margin-bottom:1.5em} td,th{border:1px solid #ccc;padding:4px}"
+                 " tr.keep{background:#dfd} img{max-width:160px}</style></head><body>",
+                 f"<h1>DupFileManager Report</h1><p>Generated {report['generated']}; {len(report['sets'])} duplicate sets</p>"]
+        for setNo, dupSet in enumerate(report['sets']):
+            lines += [f"<h3>Set {setNo + 1}</h3><table><tr><th></th><th>Keep</th><th>Score</th><th>Resolution</th><th>Duration</th><th>Size</th><th>Exact</th><th>Path</th></tr>"]
+            for dup in dupSet:
+                thumb = f"<img src='{html.escape(dup['thumbnail'])}' loading='lazy'>" if dup['thumbnail'] else ""
+                exact = "" if dup['exactDup'] == None else ("Yes" if dup['exactDup'] else "No")
+                lines += [f"<tr class='{'keep' if dup['keep'] else 'dup'}'><td><a href='{html.escape(dup['url'])}'>{thumb}</a></td><td>{'Keep' if dup['keep'] else ''}</td>"
+                          f"<td>{dup['score']}</td><td>{dup['width']} x {dup['height']}</td><td>{dup['duration']}</td><td>{dup['size']}</td><td>{exact}</td>"
+                          f"<td><a href='{html.escape(dup['url'])}'>{html.escape(dup['path'])}</a></td></tr>"]
+            lines += ["</table>"]
+        lines += ["</body></html>"]
+        return "\n".join(lines)
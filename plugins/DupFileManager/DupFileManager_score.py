@@ -0,0 +1,81 @@
+# Description: Scores duplicate candidates to select which duplicate to keep (DupFileToKeep) in DupFileManager.
+# Every candidate of every duplicate set becomes a row of features. By default the candidates are ordered by the features one after
+# the other (resolution, duration, whitelist, blacklist, graylist, path length, then size), so a feature only matters when all features
+# before it are equal, like the previous selection rules. When weights are configured, each feature is divided by its maximum within the set,
+# so that all features are between 0 and 1, and the score is the sum of the features multiplied by their weights.
+# The first candidate of a set is the one to keep. Weighted scores are calculated for all sets at once with NumPy, which is only required when weights are configured.
+import csv
+
+class KeeperScorer:
+    FEATURES = ['resolution', 'duration', 'whitelist', 'blacklist', 'graylist', 'pathLength', 'size']
+    # Weights used for the features missing from the configured weights
+    DEFAULT_WEIGHTS = {'resolution': 1000, 'duration': 100, 'whitelist': 50, 'blacklist': -25, 'graylist': 10, 'pathLength': 2, 'size': 1}
+    # Sort direction of each feature when ranking without weights. 1 = Higher is better, -1 = Lower is better
+    ORDER_DIRECTIONS = {'resolution': 1, 'duration': 1, 'whitelist': 1, 'blacklist': -1, 'graylist': 1, 'pathLength': 1, 'size': 1}
+    weights = None # None = Rank by the features in FEATURES order
+    numpy = None # Imported only when weights are configured
+    isInWhitelist = None
+    isInBlacklist = None
+    isInGraylist = None
+
+    def __init__(self, isInWhitelist, isInBlacklist, isInGraylist, weights=None):
+        self.isInWhitelist = isInWhitelist
+        self.isInBlacklist = isInBlacklist
+        self.isInGraylist = isInGraylist
+        if weights:
+            import numpy # Requirement: pip install numpy. Raises ImportError if missing.
+            self.numpy = numpy
+            self.weights = self.DEFAULT_WEIGHTS.copy()
+            self.weights.update(weights)
+
+    def features(self, scene):
+        file = scene['files'][0]
+        path = file['path']
+        return [int(file['width']) * int(file['height']), int(float(file['duration'])), # Do not count fractions of a second as a difference
+                1 if self.isInWhitelist(path) else 0, 1 if self.isInBlacklist(path) else 0, 1 if self.isInGraylist(path) else 0,
+                len(path), int(file['size'])]
+
+    # Returns a list for each set of {'scene', 'score', 'features'}, sorted from the duplicate to keep to the lowest score.
+    # Candidates with the same score keep their original order, so the first scene of the set is kept on a tie.
+    # Without weights, the score is the quantity of candidates in the set ranked below the candidate.
+    def rank(self, DupSceneSets):
+        rows = []
+        setIndex = []
+        for setNo, DupSceneSet in enumerate(DupSceneSets):
+            for scene in DupSceneSet:
+                rows += [self.features(scene)]
+                setIndex += [setNo]
+        rankedSets = [[] for DupSceneSet in DupSceneSets]
+        if len(rows) == 0:
+            return rankedSets
+        scenes = [scene for DupSceneSet in DupSceneSets for scene in DupSceneSet]
+        if self.weights == None:
+            directions = [self.ORDER_DIRECTIONS[name] for name in self.FEATURES]
+            start = 0
+            for setNo, DupSceneSet in enumerate(DupSceneSets):
+                # sorted is stable, so candidates with equal features keep their original order
+                order = sorted(range(start, start + len(DupSceneSet)), key=lambda i: [-value * direction for value, direction in zip(rows[i], directions)])
+                for rankNo, i in enumerate(order):
+                    rankedSets[setNo] += [{'scene': scenes[i], 'score': float(len(order) - 1 - rankNo), 'features': dict(zip(self.FEATURES, rows[i]))}]
+                start += len(DupSceneSet)
+            return rankedSets
+        numpy = self.numpy
+        features = numpy.array(rows, dtype=numpy.float64)
+        setIndex = numpy.array(setIndex)
+        position = numpy.arange(len(rows))
+        newSet = numpy.r_[True, setIndex[1:] != setIndex[:-1]]
+        setMax = numpy.maximum.reduceat(features, numpy.flatnonzero(newSet), axis=0)[numpy.cumsum(newSet) - 1]
+        normalized = numpy.divide(features, setMax, out=numpy.zeros_like(features), where=setMax > 0)
+        scores = normalized @ numpy.array([float(self.weights[name]) for name in self.FEATURES])
+        for i in numpy.lexsort((position, -scores, setIndex)):
+            rankedSets[setIndex[i]] += [{'scene': scenes[i], 'score': float(scores[i]), 'features': dict(zip(self.FEATURES, rows[i]))}]
+        return rankedSets
+
+    def writeReport(self, reportFile, rankedSets):
+        with open(reportFile, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['set', 'scene_id', 'keep', 'score'] + self.FEATURES + ['path'])
+            for setNo, rankedSet in enumerate(rankedSets):
+                for rankNo, ranked in enumerate(rankedSet):
+                    writer.writerow([setNo + 1, ranked['scene']['id'], rankNo == 0, round(ranked['score'], 3)]
+                                    + [ranked['features'][name] for name in self.FEATURES] + [ranked['scene']['files'][0]['path']])
@@ -0,0 +1,72 @@
+# Description: Verifies that duplicate candidates are exact (byte for byte) duplicates before DupFileManager deletes them.
+# Files are first compared by size, then by hashes of sampled blocks taken from the head, middle and tail of the memory-mapped file.
+# Only when all samples match is the whole file hashed, so files which differ are rejected without reading multi-GB files.
+# Digests are cached per path, and the duplicate sets are verified in a thread pool.
+import os, mmap, hashlib
+import concurrent.futures
+
+class ContentVerifier:
+    blockSize = 1024 * 1024 # Bytes in each sampled block
+    readSize = 8 * 1024 * 1024 # Bytes read at a time when hashing the whole file
+    fullHash = True # If disabled, files with matching samples are considered exact duplicates without hashing the whole file.
+    workers = 4
+    sampleDigests = None
+    fullDigests = None
+
+    def __init__(self, blockSize=1024 * 1024, fullHash=True, workers=4):
+        self.blockSize = blockSize
+        self.fullHash = fullHash
+        self.workers = workers
+        self.sampleDigests = {}
+        self.fullDigests = {}
+
+    # Returns (size, hash of the head, middle and tail blocks)
+    def sampleDigest(self, path):
+        if path not in self.sampleDigests:
+            size = os.path.getsize(path)
+            digest = hashlib.blake2b(digest_size=16)
+            if size > 0:
+                with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if size <= self.blockSize * 3:
+                        digest.update(data)
+                    else:
+                        for offset in [0, (size - self.blockSize) // 2, size - self.blockSize]:
+                            digest.update(data[offset:offset + self.blockSize])
+            self.sampleDigests[path] = (size, digest.hexdigest())
+        return self.sampleDigests[path]
+
+    def fullDigest(self, path):
+        if path not in self.fullDigests:
+            digest = hashlib.blake2b()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.readSize), b''):
+                    digest.update(chunk)
+            self.fullDigests[path] = digest.hexdigest()
+        return self.fullDigests[path]
+
+    def isExactDup(self, keepPath, dupPath):
+        if os.path.getsize(keepPath) != os.path.getsize(dupPath):
+            return False
+        if self.sampleDigest(keepPath) != self.sampleDigest(dupPath):
+            return False
+        if not self.fullHash or self.sampleDigest(keepPath)[0] <= self.blockSize * 3:
+            return True
+        return self.fullDigest(keepPath) == self.fullDigest(dupPath)
+
+    def verifySet(self, keepPath, dupPaths):
+        results = {}
+        for dupPath in dupPaths:
+            try:
+                results[dupPath] = self.isExactDup(keepPath, dupPath)
+            except OSError:
+                results[dupPath] = None # Could not read one of the files
+        return results
+
+    # Takes a list of (keepPath, [dupPath, ...]), and returns a dict of dupPath to True (exact duplicate of its keepPath),
+    # False (content differs), or None (could not be read). Each set runs in its own thread, so the keeper of a set is only read once.
+    def verifySets(self, sets):
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for setResults in executor.map(lambda dupSet: self.verifySet(dupSet[0], dupSet[1]), sets):
+                results.update(setResults)
+        return results
@@ -0,0 +1,62 @@
+# Description: Work file used by DupFileManager to process duplicate sets across several runs.
+# The duplicate sets found at the start of a run are saved with the IDs of the sets already processed. When a run stops early
+# (zyMaxDupToProcess, or the plugin being stopped), the next run resumes with the remaining sets instead of searching for duplicates again.
+import os, json, time
+
+class DupWorkFile:
+    workFile = None
+    mode = None
+    maxAge = 0 # Hours before the saved sets are considered stale, and duplicates are searched again. 0 = No limit
+    sets = None
+    done = None
+    created = 0
+
+    def __init__(self, workFile, mode, maxAge=0):
+        self.workFile = workFile
+        self.mode = mode
+        self.maxAge = maxAge
+        self.sets = []
+        self.done = set()
+
+    @staticmethod
+    def setId(DupFileSet):
+        return "-".join(sorted([DupFile['id'] for DupFile in DupFileSet], key=int))
+
+    # Returns True if unfinished sets were loaded for the same mode
+    def load(self):
+        if not os.path.isfile(self.workFile):
+            return False
+        try:
+            with open(self.workFile, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return False
+        if data['mode'] != self.mode or (self.maxAge > 0 and time.time() - data['created'] > self.maxAge * 3600):
+            return False
+        self.sets = [[{'id': sceneID} for sceneID in sceneIDs] for sceneIDs in data['sets']]
+        self.done = set(data['done'])
+        self.created = data['created']
+        return True
+
+    def start(self, DupFileSets):
+        self.sets = DupFileSets
+        self.done = set()
+        self.created = time.time()
+        self.save()
+
+    def pendingSets(self):
+        return [DupFileSet for DupFileSet in self.sets if self.setId(DupFileSet) not in self.done]
+
+    def markDone(self, DupFileSet):
+        self.done.add(self.setId(DupFileSet))
+
+    def save(self):
+        data = {'mode': self.mode, 'created': self.created, 'sets': [[DupFile['id'] for DupFile in DupFileSet] for DupFileSet in self.sets], 'done': sorted(self.done)}
+        tmpFile = f"{self.workFile}.tmp"
+        with open(tmpFile, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmpFile, self.workFile)
+
+    def finish(self):
+        if os.path.isfile(self.workFile):
+            os.remove(self.workFile)
@@ -12,6 +12,7 @@ from multiprocessing import shared_memory
 from filemonitor_config import config
 from filemonitor_task_examples import task_examples
 from filemonitor_self_unit_test import self_unit_test
+from filemonitor_batch import ScanBatcher, FileStabilizer, reduceScanPaths
 
 config['task_scheduler'] = config['task_scheduler'] + task_examples['task_scheduler']
 if self_unit_test['selfUnitTest_repeat']:
@@ -71,6 +72,11 @@ SCAN_ON_ANY_EVENT = stash.pluginConfig['onAnyEvent']
 SIGNAL_TIMEOUT = stash.pluginConfig['timeOut'] if stash.pluginConfig['timeOut'] > 0 else 1
 MAX_TIMEOUT_FOR_DELAY_PATH_PROCESS = stash.pluginConfig['timeOutDelayProcess']
 MAX_SECONDS_WAIT_SCANJOB_COMPLETE = stash.pluginConfig['maxWaitTimeJobFinish']
+SCAN_QUIET_PERIOD = stash.pluginConfig['scanQuietPeriod']
+SCAN_MAX_WAIT = stash.pluginConfig['scanMaxWait']
+SCAN_COLLAPSE_SIBLINGS = stash.pluginConfig['scanCollapseSiblings']
+SCAN_FILE_LIMIT = stash.pluginConfig['scanFileLimit']
+SCAN_STABLE_TIME = stash.pluginConfig['scanStableTime']
 
 CREATE_SPECIAL_FILE_TO_EXIT = stash.pluginConfig['createSpecFileToExit']
 DELETE_SPECIAL_FILE_ON_STOP = stash.pluginConfig['deleteSpecFileInStop']
@@ -292,7 +298,8 @@ class StashScheduler: # Stash Scheduler
             if 'args' in task and len(task['args']) > 0:
                 args = args + [task['args']]
             stash.Log(f"Executing command arguments {args}.")
-            return f"Execute process PID = {stash.ExecuteProcess(args)}"
+            pid = stash.ExecuteProcess(args, taskName=task.get('taskName', cmd), maxInstances=task.get('maxInstances', 1))
+            return f"Execute process PID = {pid}" if pid != None else None
         else:
             stash.Error(f"Can not run task '{task['task']}', because it's missing 'command' field.")
         return None
@@ -307,7 +314,8 @@ class StashScheduler: # Stash Scheduler
             detached = True
             if 'detach' in task:
                 detached = task['detach']
-            return f"Python process PID = {stash.ExecutePythonScript(args, ExecDetach=detached)}"
+            pid = stash.ExecutePythonScript(args, ExecDetach=detached, taskName=task.get('taskName', script), maxInstances=task.get('maxInstances', 1))
+            return f"Python process PID = {pid}" if pid != None else None
         else:
             stash.Error(f"Can not run task '{task['task']}', because it's missing 'script' field.")
         return None
@@ -473,8 +481,23 @@ def start_library_monitor():
     RunCleanMetadata = False
     stashScheduler = StashScheduler() if stash.pluginSettings['turnOnScheduler'] else None   
     event_handler = watchdog.events.FileSystemEventHandler()
-    def doIgnoreFileExt(chng_path, addToTargetPaths = False):
-        global TargetPaths
+    scanBatcher = ScanBatcher(quietPeriod=SCAN_QUIET_PERIOD, maxWait=SCAN_MAX_WAIT, fileScanLimit=SCAN_FILE_LIMIT)
+    fileStabilizer = FileStabilizer(stableTime=SCAN_STABLE_TIME)
+    def addToScanBatch(chng_path, fileScan = False):
+        # Changes to the FileMonitor working folder (kill trigger file) are handled without waiting for the quiet period
+        immediate = chng_path.startswith(SPECIAL_FILE_DIR)
+        # New files wait in fileStabilizer until they are completely written
+        if fileScan and not immediate and SCAN_STABLE_TIME > 0 and os.path.isfile(chng_path):
+            fileStabilizer.add(chng_path)
+        else:
+            scanBatcher.add(chng_path, immediate=immediate, fileScan=fileScan)
+    
+    def addStableFilesToScanBatch(force = False):
+        for path in fileStabilizer.takeStable(force):
+            stash.Trace(f"File is completely written '{path}'")
+            scanBatcher.add(path, fileScan=True)
+    
+    def doIgnoreFileExt(chng_path, addToTargetPaths = False, fileScan = False):
         chng_path_lwr = chng_path.lower()
         if len(fileExtTypes) > 0:
             suffix = pathlib.Path(chng_path_lwr).suffix.lstrip(".")
@@ -487,12 +510,12 @@ def start_library_monitor():
                     stash.TraceOnce(f"Ignoring file change because is excluded path ({chng_path_lwr}) per entery '{path}'.")
                     return True
         if addToTargetPaths:
-            TargetPaths.append(chng_path)
+            addToScanBatch(chng_path, fileScan)
         return False
     
     def on_created(event):
         global shouldUpdate
-        if doIgnoreFileExt(event.src_path, True):
+        if doIgnoreFileExt(event.src_path, True, fileScan=True):
             return
         stash.Log(f"CREATE *** '{event.src_path}'")
         with mutex:
@@ -512,11 +535,12 @@ def start_library_monitor():
 
     def on_modified(event):
         global shouldUpdate
-        global TargetPaths
         if doIgnoreFileExt(event.src_path):
             return
-        if SCAN_MODIFIED:
-            TargetPaths.append(event.src_path)
+        if fileStabilizer.touch(event.src_path):
+            stash.TraceOnce(f"Ignoring modifications of a file still being written. path='{event.src_path}'")
+        elif SCAN_MODIFIED:
+            addToScanBatch(event.src_path)
             stash.Log(f"MODIFIED ***  '{event.src_path}'")
             with mutex:
                 shouldUpdate = True
@@ -526,23 +550,27 @@ def start_library_monitor():
 
     def on_moved(event):
         global shouldUpdate
-        global TargetPaths
         if doIgnoreFileExt(event.src_path, True):
             return
-        TargetPaths.append(event.dest_path)
+        addToScanBatch(event.dest_path, fileScan=True)
         stash.Log(f"MOVE ***  from '{event.src_path}' to '{event.dest_path}'")
         with mutex:
             shouldUpdate = True
             signal.notify()
     
+    def on_closed(event):
+        if fileStabilizer.close(event.src_path):
+            stash.Trace(f"CLOSED ***  '{event.src_path}'")
+            with mutex:
+                signal.notify()
+    
     def on_any_event(event):
         global shouldUpdate
-        global TargetPaths
         if doIgnoreFileExt(event.src_path):
             return
         if SCAN_ON_ANY_EVENT or event.src_path == SPECIAL_FILE_DIR:
             stash.Log(f"Any-Event ***  '{event.src_path}'")
-            TargetPaths.append(event.src_path)
+            addToScanBatch(event.src_path)
             with mutex:
                 shouldUpdate = True
                 signal.notify()
@@ -553,6 +581,7 @@ def start_library_monitor():
     event_handler.on_deleted = on_deleted
     event_handler.on_modified = on_modified
     event_handler.on_moved = on_moved
+    event_handler.on_closed = on_closed # Only triggered by observers supporting close-write events (inotify)
     event_handler.on_any_event = on_any_event
     
     observer = Observer()
@@ -571,8 +600,9 @@ def start_library_monitor():
         while True:
             TmpTargetPaths = []
             with mutex:
-                while not shouldUpdate:
-                    stash.TraceOnce("While not shouldUpdate")
+                addStableFilesToScanBatch()
+                while not scanBatcher.hasReady():
+                    stash.TraceOnce("While no scan batch is ready")
                     if stash.CALLED_AS_STASH_PLUGIN and isJobWaitingToRun():
                         if FileMonitorPluginIsOnTaskQue:
                             stash.Log(f"Another task (JobID={JobIdInTheQue}) is waiting on the queue. Will restart FileMonitor to allow other task to run.")
@@ -595,7 +625,16 @@ def start_library_monitor():
                         stash.LogOnce(f"Awaiting file change-trigger, with a short timeout ({timeOutInSeconds} seconds), because of active delay path processing.")
                     else:
                         stash.LogOnce(f"Waiting for a file change-trigger. Timeout = {timeOutInSeconds} seconds.")
+                    secondsUntilBatchReady = scanBatcher.secondsUntilReady()
+                    if secondsUntilBatchReady != None and secondsUntilBatchReady < timeOutInSeconds:
+                        timeOutInSeconds = secondsUntilBatchReady
+                        stash.TraceOnce(f"Waiting {timeOutInSeconds} seconds for the changed directories to be quiet.")
+                    secondsUntilFileStable = fileStabilizer.secondsUntilStable()
+                    if secondsUntilFileStable != None and secondsUntilFileStable < timeOutInSeconds:
+                        timeOutInSeconds = secondsUntilFileStable
+                        stash.TraceOnce(f"Waiting {timeOutInSeconds} seconds for new files to be completely written.")
                     signal.wait(timeout=timeOutInSeconds)
+                    addStableFilesToScanBatch()
                     if lastScanJob['DelayedProcessTargetPaths'] != []:
                         stash.TraceOnce(f"Processing delay scan for path(s) {lastScanJob['DelayedProcessTargetPaths']}")
                         break
@@ -606,10 +645,17 @@ def start_library_monitor():
                     else:
                         stash.TraceOnce("Wait timeout occurred.")
                 shouldUpdate = False
+                # When exiting, scan all pending changes instead of waiting for the quiet period
+                if JobIsRunning or shm_buffer[0] != CONTINUE_RUNNING_SIG:
+                    addStableFilesToScanBatch(force=True)
+                TargetPaths, ScanPaths, QtyEvents, QtyDirs, longestWait = scanBatcher.takeReady(force=JobIsRunning or shm_buffer[0] != CONTINUE_RUNNING_SIG)
+                if QtyDirs > 0:
+                    stash.Log(f"Scan batch absorbed {QtyEvents} file change event(s) from {QtyDirs} directory(s); longest wait {longestWait:.1f} seconds. (Total events={scanBatcher.QtyEvents}, batches={scanBatcher.QtyBatches}, file scans={scanBatcher.QtyFileScans}, files waited on={fileStabilizer.QtyFiles}, still changing={fileStabilizer.QtyStillChanging})")
                 TmpTargetPaths = []
+                for ScanPath in ScanPaths:
+                    TmpTargetPaths.append(ScanPath)
+                    stash.Trace(f"Added Path {ScanPath}")
                 for TargetPath in TargetPaths:
-                    TmpTargetPaths.append(os.path.dirname(TargetPath))
-                    stash.Trace(f"Added Path {os.path.dirname(TargetPath)}")
                     if TargetPath == SPECIAL_FILE_NAME:
                         if os.path.isfile(SPECIAL_FILE_NAME):
                             shm_buffer[0] = STOP_RUNNING_SIG
@@ -657,6 +703,10 @@ def start_library_monitor():
                                             lastScanJob['DelayedProcessTargetPaths'].append(path)
                                 stash.Trace(f"lastScanJob['DelayedProcessTargetPaths'] = {lastScanJob['DelayedProcessTargetPaths']}")
                         if lastScanJob['id'] == -1:
+                            QtyPaths = len(TmpTargetPaths)
+                            TmpTargetPaths = reduceScanPaths(TmpTargetPaths, SCAN_COLLAPSE_SIBLINGS, includePathChanges, [path for path in TmpTargetPaths if os.path.isfile(path)])
+                            if len(TmpTargetPaths) < QtyPaths:
+                                stash.Log(f"Reduced {QtyPaths} scan paths to {len(TmpTargetPaths)} covering path(s).")
                             stash.Trace(f"Calling metadata_scan for paths '{TmpTargetPaths}'")
                             lastScanJob['id'] = int(stash.metadata_scan(paths=TmpTargetPaths))
                             lastScanJob['TargetPaths'] = TmpTargetPaths
@@ -683,6 +733,7 @@ def start_library_monitor():
     except KeyboardInterrupt:
         observer.stop()
         stash.Trace("Stopping observer")
+        stash.StopTasks()
         if os.path.isfile(SPECIAL_FILE_NAME):
             os.remove(SPECIAL_FILE_NAME)
     observer.join()
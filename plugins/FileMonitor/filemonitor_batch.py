@@ -0,0 +1,216 @@
+# Description: Coalesces file change events into scan batches for FileMonitor.
+# Changes are grouped by directory. A directory is only handed to the scan once no change occurred in it for quietPeriod seconds,
+# or once maxWait seconds passed since its first change, so copying many files into a folder results in a single scan.
+# When fileScanLimit is set, a directory with only a few new files is scanned by file path, so the rest of the directory is not rescanned.
+import os, time, pathlib
+from threading import Lock
+
+class ScanBatcher:
+    quietPeriod = 5
+    maxWait = 60
+    fileScanLimit = 0 # Maximum new files in a directory scanned by file path. 0 = Always scan the directory
+    pending = None # Directory -> {'first' : time of first change, 'last' : time of last change, 'events' : quantity, 'paths' : changed paths, 'files' : paths which can be scanned as files, 'dirOnly' : True if the directory must be scanned}
+    lock = None
+    # Metrics
+    QtyEvents = 0
+    QtyBatches = 0
+    QtyFileScans = 0
+
+    def __init__(self, quietPeriod=5, maxWait=60, fileScanLimit=0):
+        self.quietPeriod = quietPeriod
+        self.maxWait = maxWait
+        self.fileScanLimit = fileScanLimit
+        self.pending = {}
+        self.lock = Lock()
+
+    # Called from the watchdog thread for each change. If immediate is True, the directory is ready on the next check.
+    # fileScan is True for new files (created or moved in), which can be scanned by themselves. Other changes (deletes) require a directory scan.
+    def add(self, path, immediate=False, fileScan=False):
+        now = time.time()
+        dirName = os.path.dirname(path)
+        with self.lock:
+            self.QtyEvents += 1
+            entry = self.pending.setdefault(dirName, {'first' : now, 'last' : now, 'events' : 0, 'paths' : set(), 'files' : set(), 'dirOnly' : False})
+            entry['last'] = now
+            entry['events'] += 1
+            entry['paths'].add(path)
+            if fileScan and not immediate:
+                entry['files'].add(path)
+            else:
+                entry['dirOnly'] = True
+            if immediate:
+                entry['first'] = entry['last'] = 0
+
+    def isDirReady(self, entry, now):
+        return now - entry['last'] >= self.quietPeriod or now - entry['first'] >= self.maxWait
+
+    # Returns the paths to scan for a directory; the new files when there are few enough of them, otherwise the directory
+    def scanPaths(self, dirName, entry):
+        if self.fileScanLimit < 1 or entry['dirOnly'] or len(entry['files']) > self.fileScanLimit:
+            return [dirName]
+        # A file removed or renamed again before the scan is handled by scanning its directory
+        if not all(os.path.exists(path) for path in entry['files']):
+            return [dirName]
+        return sorted(entry['files'])
+
+    def hasReady(self):
+        now = time.time()
+        with self.lock:
+            return any(self.isDirReady(entry, now) for entry in self.pending.values())
+
+    # Seconds until the next directory is ready, or None if nothing is pending
+    def secondsUntilReady(self):
+        now = time.time()
+        with self.lock:
+            if len(self.pending) == 0:
+                return None
+            return max(0, min(min(entry['last'] + self.quietPeriod, entry['first'] + self.maxWait) - now for entry in self.pending.values()))
+
+    # Removes the ready directories (all directories if force is True) from the pending list.
+    # Returns (changed paths, paths to scan, quantity of events absorbed, quantity of directories, longest wait in seconds)
+    def takeReady(self, force=False):
+        now = time.time()
+        paths = []
+        scanPaths = []
+        QtyEvents = 0
+        longestWait = 0
+        with self.lock:
+            readyDirs = [dirName for dirName, entry in self.pending.items() if force or self.isDirReady(entry, now)]
+            for dirName in readyDirs:
+                entry = self.pending.pop(dirName)
+                paths += sorted(entry['paths'])
+                dirScanPaths = self.scanPaths(dirName, entry)
+                if dirScanPaths != [dirName]:
+                    self.QtyFileScans += len(dirScanPaths)
+                scanPaths += dirScanPaths
+                QtyEvents += entry['events']
+                longestWait = max(longestWait, now - entry['first'] if entry['first'] > 0 else 0)
+            if len(readyDirs) > 0:
+                self.QtyBatches += 1
+        return paths, scanPaths, QtyEvents, len(readyDirs), longestWait
+
+TERMINAL = None # Trie key marking a path to scan
+
+# Returns the smallest list of directories covering all the paths, so the scan does not walk the same subtree twice.
+# Paths under another path in the list are dropped, and when more than maxSiblings subdirectories of a directory changed,
+# they are replaced by the directory itself. Directories are only collapsed into a parent inside one of the roots (Stash library paths).
+# filePaths are the paths scanned as files (ScanBatcher fileScanLimit). They do not count as subdirectories, so new files are not collapsed
+# into a directory scan here; ScanBatcher already scans the directory when it has more than fileScanLimit new files.
+def reduceScanPaths(paths, maxSiblings=0, roots=None, filePaths=None):
+    rootParts = [pathlib.PurePath(root).parts for root in roots] if roots else None
+    fileParts = {pathlib.PurePath(path).parts for path in filePaths} if filePaths else set()
+    trie = {} # Path part -> child node. A node holding the key TERMINAL is a path to scan.
+    for parts in sorted({pathlib.PurePath(path).parts for path in paths}, key=len):
+        node = trie
+        for part in parts:
+            if TERMINAL in node:
+                break # An ancestor is already scanned
+            node = node.setdefault(part, {})
+        else:
+            node.clear()
+            node[TERMINAL] = True
+
+    def canCollapseInto(parts):
+        if len(parts) == 0:
+            return False
+        if rootParts == None:
+            return True
+        return any(parts[:len(root)] == root for root in rootParts)
+
+    def collapse(node, parts):
+        QtyDirs = 0
+        for part, child in node.items():
+            if part != TERMINAL:
+                collapse(child, parts + (part,))
+                if TERMINAL not in child or parts + (part,) not in fileParts:
+                    QtyDirs += 1
+        if maxSiblings > 0 and TERMINAL not in node and QtyDirs > maxSiblings and canCollapseInto(parts):
+            node.clear()
+            node[TERMINAL] = True
+    collapse(trie, ())
+
+    reducedPaths = []
+    def collect(node, parts):
+        if TERMINAL in node:
+            reducedPaths.append(str(pathlib.PurePath(*parts)))
+            return
+        for part, child in node.items():
+            collect(child, parts + (part,))
+    collect(trie, ())
+    return reducedPaths
+
+# Holds new files until they stop changing, so a file which is still being copied is not scanned half-written.
+# A file is stable once its size and modified time were unchanged for stableTime seconds, or once it was closed after writing (inotify close-write).
+class FileStabilizer:
+    stableTime = 10
+    pending = None # Path -> {'size' : last size, 'mtime' : last modified time, 'since' : time of last change, 'closed' : True if closed after writing}
+    lock = None
+    # Metrics
+    QtyFiles = 0
+    QtyStillChanging = 0
+
+    def __init__(self, stableTime=10):
+        self.stableTime = stableTime
+        self.pending = {}
+        self.lock = Lock()
+
+    def statFile(self, path):
+        try:
+            stat = os.stat(path)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    # Called from the watchdog thread when a file is created or moved in
+    def add(self, path):
+        size, mtime = self.statFile(path) or (-1, -1)
+        with self.lock:
+            if path not in self.pending:
+                self.QtyFiles += 1
+            self.pending[path] = {'size' : size, 'mtime' : mtime, 'since' : time.time(), 'closed' : False}
+
+    # Restarts the stable time of a pending file which was modified. Returns False if the file is not pending.
+    def touch(self, path):
+        with self.lock:
+            if path not in self.pending:
+                return False
+            self.pending[path]['since'] = time.time()
+            self.pending[path]['closed'] = False
+            return True
+
+    # Marks a pending file as completely written. Returns False if the file is not pending.
+    def close(self, path):
+        with self.lock:
+            if path not in self.pending:
+                return False
+            self.pending[path]['closed'] = True
+            return True
+
+    # Seconds until the next pending file can be stable, or None if nothing is pending
+    def secondsUntilStable(self):
+        now = time.time()
+        with self.lock:
+            if len(self.pending) == 0:
+                return None
+            return max(0, min(0 if entry['closed'] else entry['since'] + self.stableTime - now for entry in self.pending.values()))
+
+    # Removes and returns the stable files (all pending files if force is True).
+    # Files which no longer exist are also returned, so the scan batch falls back to scanning their directory.
+    def takeStable(self, force=False):
+        now = time.time()
+        stablePaths = []
+        with self.lock:
+            for path, entry in list(self.pending.items()):
+                if not force and not entry['closed']:
+                    stat = self.statFile(path)
+                    if stat != None:
+                        if stat != (entry['size'], entry['mtime']):
+                            entry['size'], entry['mtime'] = stat
+                            entry['since'] = now
+                            self.QtyStillChanging += 1
+                            continue
+                        if now - entry['since'] < self.stableTime:
+                            continue
+                stablePaths += [path]
+                del self.pending[path]
+        return stablePaths
@@ -0,0 +1,49 @@
+# Unit test for filemonitor_batch.py. Does not require Stash.
+# To run test: python -m unittest filemonitor_batch_unit_test.py (from the FileMonitor plugin folder)
+import os, tempfile, unittest
+from filemonitor_batch import ScanBatcher, reduceScanPaths
+
+class TestFileScans(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.libDir = os.path.join(self.tmpDir.name, "lib")
+        self.videoDir = os.path.join(self.libDir, "videos")
+        os.makedirs(self.videoDir)
+        self.files = []
+        for i in range(15):
+            self.files += [os.path.join(self.videoDir, f"video{i}.mp4")]
+            open(self.files[-1], 'w').close()
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    # More new files than scanCollapseSiblings, but not more than scanFileLimit, are still scanned by file path
+    def test_files_not_collapsed_into_directory(self):
+        scanBatcher = ScanBatcher(quietPeriod=0, fileScanLimit=20)
+        for file in self.files:
+            scanBatcher.add(file, fileScan=True)
+        paths, scanPaths, QtyEvents, QtyDirs, longestWait = scanBatcher.takeReady(force=True)
+        self.assertEqual(sorted(scanPaths), sorted(self.files))
+        reducedPaths = reduceScanPaths(scanPaths, 10, [self.libDir], [path for path in scanPaths if os.path.isfile(path)])
+        self.assertEqual(sorted(reducedPaths), sorted(self.files))
+
+    def test_file_limit_falls_back_to_directory(self):
+        scanBatcher = ScanBatcher(quietPeriod=0, fileScanLimit=10)
+        for file in self.files:
+            scanBatcher.add(file, fileScan=True)
+        self.assertEqual(scanBatcher.takeReady(force=True)[1], [self.videoDir])
+
+    def test_delete_falls_back_to_directory(self):
+        scanBatcher = ScanBatcher(quietPeriod=0, fileScanLimit=20)
+        scanBatcher.add(self.files[0], fileScan=True)
+        scanBatcher.add(os.path.join(self.videoDir, "deleted.mp4"))
+        self.assertEqual(scanBatcher.takeReady(force=True)[1], [self.videoDir])
+
+    def test_subdirectories_collapsed(self):
+        subDirs = [os.path.join(self.libDir, f"dir{i}") for i in range(11)]
+        self.assertEqual(reduceScanPaths(subDirs, 10, [self.libDir]), [self.libDir])
+        self.assertEqual(sorted(reduceScanPaths(subDirs[:10], 10, [self.libDir])), sorted(subDirs[:10]))
+        self.assertEqual(reduceScanPaths(subDirs + [self.libDir], 0, [self.libDir]), [self.libDir])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -54,6 +54,18 @@ config = {
     "timeOut": 60,
     # Timeout in seconds for delay processing of path scan jobs. This value should always be smaller than timeOut
     "timeOutDelayProcess": 32,
+    # Seconds without any file change in a directory before the directory is scanned. Changes received during this time are scanned in the same job.
+    "scanQuietPeriod": 5,
+    # Maximum seconds a changed directory waits for the quiet period, so a directory which keeps changing is still scanned.
+    "scanMaxWait": 60,
+    # When more than this many subdirectories of a directory changed, the directory is scanned instead of each subdirectory. 0 = Never collapse
+    "scanCollapseSiblings": 10,
+    # New files (created or moved in) are scanned by file path, instead of scanning the whole directory, when a directory has at most this many new files.
+    # Deleted files, and directories with more new files, are scanned by directory. 0 = Always scan the directory
+    "scanFileLimit": 20,
+    # Seconds the size and modified time of a new file must stay unchanged before it's scanned, so files still being copied are not scanned half-written.
+    # On Linux, a file is scanned as soon as it's closed after writing. 0 = Scan new files without waiting
+    "scanStableTime": 10,
     # Maximum time to wait for a scan job to complete. Need this incase Stash gets restarted in the middle of a scan job.
     "maxWaitTimeJobFinish": 30 * 60, # Wait 30 minutes max
     
@@ -71,6 +83,9 @@ config = {
     # When populated, exclude file changes in paths that start with specified entries.
     "excludePathChanges" :[], # Example: ["C:\\MyVideos\\SomeSubFolder\\", "C:\\MyImages\\folder\\Sub\\"]
     
+    # Seconds the Stash configuration fetched at startup is saved and shared with the other plugins using StashPluginHelper (FileMonitor, DupFileManager, RenameFile). The saved copy includes the Stash API key. 0 = Disabled
+    "configSnapshotTTL" : 0,
+    
     # The following fields are ONLY used when running FileMonitor in command line mode.
     "endpoint_Scheme" : "http", # Define endpoint to use when contacting the Stash server
     "endpoint_Host" : "0.0.0.0", # Define endpoint to use when contacting the Stash server
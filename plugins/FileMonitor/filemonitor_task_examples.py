@@ -45,6 +45,10 @@ task_examples = {
         # Example#C2: Task to execute a command with optional args field, and using keyword <plugin_path>, which gets replaced with filemonitor.py current directory.
         {"task" : "execute", "command" : "<plugin_path>HelloWorld.cmd", "args" : "--name David", "minutes" : 0},
         
+        # Example#C3: By default, an execute or python task is skipped while the process from its previous run is still running.
+        # Use the maxInstances field to allow more instances at once (0 = no limit). Output of the process is saved in ProcessLogs\<command>.log
+        {"task" : "execute", "command" : "<plugin_path>HelloWorld.cmd", "maxInstances" : 2, "minutes" : 0},
+        
         # Example#D1 Some OS may need the "command" field, which specifies the binary path.
         {"task" : "CheckStashIsRunning",    "command" : "<stash_path>stash-linux-arm64v8",                          "minutes" :0},
         # Example#D2 RunAfter field can be used to specify task to run after starting Stash
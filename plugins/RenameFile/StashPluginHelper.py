@@ -1,6 +1,6 @@
 from stashapi.stashapp import StashInterface
-from logging.handlers import RotatingFileHandler
-import re, inspect, sys, os, pathlib, logging, json
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import re, inspect, sys, os, time, pathlib, logging, json, queue, atexit, threading
 import concurrent.futures
 from stashapi.stash_types import PhashDistance
 import __main__
@@ -13,6 +13,8 @@ _ARGUMENT_UNSPECIFIED_ = "_ARGUMENT_UNSPECIFIED_"
         # Can optionally log out to multiple outputs for each Log or Trace call.
         # Logging includes source code line number
         # Sets a maximum plugin log file size
+        # Messages can be callables or %-format strings (logArgs), which are only formatted when the message is logged
+        # Plugin log file is written by a background thread
     # Stash Interface Features:
         # Gets STASH_URL value from command line argument and/or from STDIN_READ
         # Sets FRAGMENT_SERVER based on command line arguments or STDIN_READ
@@ -62,9 +64,16 @@ class StashPluginHelper(StashInterface):
     LOG_FILE_NAME = None
     STDIN_READ = None
     pluginLog = None
-    logLinePreviousHits = []
+    pluginLogListener = None
+    logLinePreviousHits = None # Dictionary of "function:line" to the time it was last logged by TraceOnce/LogOnce
+    logLinePreviousHitsLock = None # TraceOnce/LogOnce are called from worker threads (taskPool, DupFileManager deletion workers)
+    logOnceInterval = 0 # If greater than 0, TraceOnce/LogOnce log again after this many seconds
+    logOnceMaxEntries = 1000
     thredPool = None
+    processSupervisor = None
     STASH_INTERFACE_INIT = False
+    configSnapshotTTL = 0
+    _configuration = None
     _mergeMetadata = None
     encodeToUtf8 = False
     convertToAscii = False # If set True, it takes precedence over encodeToUtf8
@@ -105,17 +114,28 @@ class StashPluginHelper(StashInterface):
                     apiKey = None,                  # API Key only needed when username and password set while running script via command line
                     DebugTraceFieldName = "zzdebugTracing",
                     DryRunFieldName = "zzdryRun",
-                    setStashLoggerAsPluginLogger = False):              
-        self.thredPool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+                    setStashLoggerAsPluginLogger = False,
+                    asyncFileLog = True,            # Write the plugin log file from a background thread, so logging does not wait on file I/O
+                    logOnceInterval = 0,            # Seconds before TraceOnce/LogOnce log again from the same line. 0 = once per session
+                    logOnceMaxEntries = 1000,       # Maximum code lines remembered by TraceOnce/LogOnce
+                    configSnapshotTTL = None,       # Seconds the Stash configuration is shared on disk between plugins. If None, uses the configSnapshotTTL setting. 0 = disabled
+                    threadPoolSize = 2,             # Worker threads used by Submit
+                    threadPoolMaxQueued = 0):       # Maximum tasks waiting for a worker thread. When reached, Submit blocks until a task completes. 0 = No limit
+        self.logLinePreviousHits = {}
+        self.logLinePreviousHitsLock = threading.Lock()
+        self.logOnceInterval = logOnceInterval
+        self.logOnceMaxEntries = logOnceMaxEntries
         if logToWrnSet: self.log_to_wrn_set = logToWrnSet
         if logToErrSet: self.log_to_err_set = logToErrSet
         if logToNormSet: self.log_to_norm = logToNormSet
         if stash_url and len(stash_url): self.STASH_URL = stash_url
         self.MAIN_SCRIPT_NAME = mainScriptName if mainScriptName != "" else __main__.__file__
         self.PLUGIN_ID = pluginID if pluginID != "" else pathlib.Path(self.MAIN_SCRIPT_NAME).stem
+        self.thredPool = taskPool(self, maxWorkers=threadPoolSize, maxQueued=threadPoolMaxQueued)
         # print(f"self.MAIN_SCRIPT_NAME={self.MAIN_SCRIPT_NAME}, self.PLUGIN_ID={self.PLUGIN_ID}", file=sys.stderr)
         self.LOG_FILE_NAME = logFilePath if logFilePath != "" else f"{pathlib.Path(self.MAIN_SCRIPT_NAME).resolve().parent}{os.sep}{pathlib.Path(self.MAIN_SCRIPT_NAME).stem}.log" 
         self.LOG_FILE_DIR = pathlib.Path(self.LOG_FILE_NAME).resolve().parent 
+        self.processSupervisor = processSupervisor(self)
         RFH = RotatingFileHandler(
             filename=self.LOG_FILE_NAME, 
             mode='a',
@@ -176,8 +196,10 @@ class StashPluginHelper(StashInterface):
             self.STASH_URL = self.STASH_URL.replace("http://0.0.0.0:", "http://localhost:")
         
         if self.STASH_INTERFACE_INIT:
-            self.PLUGIN_CONFIGURATION = self.get_configuration()["plugins"]
-            self.STASH_CONFIGURATION = self.get_configuration()["general"]
+            self.configSnapshotTTL = configSnapshotTTL if configSnapshotTTL != None else self.Setting('configSnapshotTTL', 0)
+            configuration = self.get_stash_configuration()
+            self.PLUGIN_CONFIGURATION = configuration["plugins"]
+            self.STASH_CONFIGURATION = configuration["general"]
             self.STASHPATHSCONFIG = self.STASH_CONFIGURATION['stashes']
             if 'pluginsPath' in self.STASH_CONFIGURATION:
                 self.PLUGINS_PATH = self.STASH_CONFIGURATION['pluginsPath']
@@ -194,13 +216,59 @@ class StashPluginHelper(StashInterface):
         self.DEBUG_TRACING = self.Setting(DebugTraceFieldName, self.DEBUG_TRACING)
         if self.DEBUG_TRACING: self.LOG_LEVEL = logging.DEBUG
         
-        logging.basicConfig(level=self.LOG_LEVEL, format=logFormat, datefmt=dateFmt, handlers=[RFH])
+        if asyncFileLog:
+            # The QueueHandler formats the record in the calling thread, and the listener thread only writes the formatted line to the file.
+            logQueue = queue.SimpleQueue()
+            self.pluginLogListener = QueueListener(logQueue, RFH)
+            self.pluginLogListener.start()
+            atexit.register(self.pluginLogListener.stop)
+            logging.basicConfig(level=self.LOG_LEVEL, format=logFormat, datefmt=dateFmt, handlers=[QueueHandler(logQueue)])
+        else:
+            logging.basicConfig(level=self.LOG_LEVEL, format=logFormat, datefmt=dateFmt, handlers=[RFH])
         self.pluginLog = logging.getLogger(pathlib.Path(self.MAIN_SCRIPT_NAME).stem)
         if setStashLoggerAsPluginLogger:
             self.log = self.pluginLog
     
     def __del__(self):
-        self.thredPool.shutdown(wait=False)
+        try:
+            self.thredPool.shutdown(wait=False, cancelPending=True)
+        except:
+            pass # Logging may no longer be available while the interpreter exits
+    
+    # Only the configuration fields used by the plugins
+    CONFIGURATION_QUERY = "query Configuration { configuration { plugins general { stashes { path excludeVideo excludeImage } pluginsPath apiKey backupDirectoryPath databasePath } } }"
+    PLUGINS_CONFIGURATION_QUERY = "query Configuration { configuration { plugins } }"
+    
+    # Fetches the Stash configuration once per instance. When configSnapshotTTL is set, the configuration is also saved in the plugins folder,
+    # and plugins started within configSnapshotTTL seconds (FileMonitor, DupFileManager, RenameFile) use the saved copy instead of querying Stash.
+    # The plugin settings are always fetched, and the saved copy is only used while they are unchanged, so settings edited in the UI apply immediately.
+    def get_stash_configuration(self, refresh=False):
+        if self._configuration != None and not refresh:
+            return self._configuration
+        snapshotFile = f"{pathlib.Path(self.MAIN_SCRIPT_NAME).resolve().parent.parent}{os.sep}.StashPluginHelper_configuration.json"
+        snapshots = {}
+        if self.configSnapshotTTL > 0 and not refresh:
+            try:
+                with open(snapshotFile, 'r', encoding='utf-8') as f:
+                    snapshots = json.load(f)
+                if self.STASH_URL in snapshots and time.time() - snapshots[self.STASH_URL]['time'] < self.configSnapshotTTL:
+                    if snapshots[self.STASH_URL]['configuration']['plugins'] == self.call_GQL(self.PLUGINS_CONFIGURATION_QUERY)['configuration']['plugins']:
+                        self._configuration = snapshots[self.STASH_URL]['configuration']
+                        return self._configuration
+                    self.Trace("Plugin settings changed since the configuration snapshot was saved")
+            except (OSError, ValueError, KeyError):
+                snapshots = {}
+        self._configuration = self.call_GQL(self.CONFIGURATION_QUERY)['configuration']
+        if self.configSnapshotTTL > 0:
+            snapshots[self.STASH_URL] = {'time' : time.time(), 'configuration' : self._configuration}
+            try:
+                tmpFile = f"{snapshotFile}.{os.getpid()}.tmp"
+                with open(os.open(tmpFile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f: # Contains the API key
+                    json.dump(snapshots, f)
+                os.replace(tmpFile, snapshotFile)
+            except OSError as e:
+                self.Warn(f"Could not save configuration snapshot {snapshotFile}. Error: {e}")
+        return self._configuration
     
     def Setting(self, name, default=_ARGUMENT_UNSPECIFIED_, raiseEx=True, notEmpty=False):
         if self.pluginSettings != None and name in self.pluginSettings:
@@ -213,11 +281,16 @@ class StashPluginHelper(StashInterface):
             raise Exception(f"Missing {name} from both UI settings and config file settings.") 
         return default
     
-    def Log(self, logMsg, printTo = 0, logLevel = logging.INFO, lineNo = -1, levelStr = "", logAlways = False, toAscii = None):
-        if toAscii or (toAscii == None and (self.encodeToUtf8 or self.convertToAscii)):
-            logMsg = self.asc2(logMsg)
-        else:
-            logMsg = logMsg
+    # logMsg can be a callable returning the message, or a %-format string with its arguments in logArgs.
+    # Either way, the message is only built when it is going to be logged.
+    def formatMsg(self, logMsg, logArgs = None):
+        if callable(logMsg):
+            logMsg = logMsg()
+        if logArgs != None:
+            logMsg = logMsg % logArgs
+        return logMsg
+    
+    def Log(self, logMsg, printTo = 0, logLevel = logging.INFO, lineNo = -1, levelStr = "", logAlways = False, toAscii = None, logArgs = None):
         if printTo == 0: 
             printTo = self.log_to_norm
         elif printTo == self.LOG_TO_ERROR and logLevel == logging.INFO:
@@ -229,6 +302,11 @@ class StashPluginHelper(StashInterface):
         elif printTo == self.LOG_TO_WARN and logLevel == logging.INFO:
             logLevel = logging.WARN
             printTo = self.log_to_wrn_set
+        if logLevel == logging.DEBUG and not self.DEBUG_TRACING and not logAlways and not (printTo & self.LOG_TO_STASH):
+            return # Debug messages are dropped by the plugin log file, console and stderr when not tracing
+        logMsg = self.formatMsg(logMsg, logArgs)
+        if toAscii or (toAscii == None and (self.encodeToUtf8 or self.convertToAscii)):
+            logMsg = self.asc2(logMsg)
         if lineNo == -1:
             lineNo = inspect.currentframe().f_back.f_lineno
         LN_Str = f"[LN:{lineNo}]"
@@ -258,47 +336,61 @@ class StashPluginHelper(StashInterface):
         if (printTo & self.LOG_TO_STDERR) and (logLevel != logging.DEBUG or self.DEBUG_TRACING or logAlways):
             print(f"StdErr: {LN_Str} {levelStr}{logMsg}", file=sys.stderr)
     
-    def Trace(self, logMsg = "", printTo = 0, logAlways = False, lineNo = -1, toAscii = None):
+    def Trace(self, logMsg = "", printTo = 0, logAlways = False, lineNo = -1, toAscii = None, logArgs = None):
+        if not self.DEBUG_TRACING and not logAlways:
+            return # Checked before any frame inspection or message formatting
         if printTo == 0: printTo = self.LOG_TO_FILE
         if lineNo == -1:
             lineNo = inspect.currentframe().f_back.f_lineno
         logLev = logging.INFO if logAlways else logging.DEBUG
-        if self.DEBUG_TRACING or logAlways:
-            if logMsg == "":
-                logMsg = f"Line number {lineNo}..."
-            self.Log(logMsg, printTo, logLev, lineNo, self.LEV_TRACE, logAlways, toAscii=toAscii)
+        if logMsg == "":
+            logMsg = f"Line number {lineNo}..."
+        self.Log(logMsg, printTo, logLev, lineNo, self.LEV_TRACE, logAlways, toAscii=toAscii, logArgs=logArgs)
+    
+    # Returns True the first time called for FuncAndLineNo, or when more than interval seconds passed since it last returned True.
+    # When more than logOnceMaxEntries lines are remembered, the line logged the longest time ago is forgotten.
+    def isLogOnceDue(self, FuncAndLineNo, interval = None):
+        if interval == None: interval = self.logOnceInterval
+        now = time.monotonic()
+        with self.logLinePreviousHitsLock:
+            lastHit = self.logLinePreviousHits.get(FuncAndLineNo)
+            if lastHit != None and (interval <= 0 or now - lastHit < interval):
+                return False
+            self.logLinePreviousHits.pop(FuncAndLineNo, None) # Re-insert, so the dictionary stays ordered by the time last logged
+            self.logLinePreviousHits[FuncAndLineNo] = now
+            if len(self.logLinePreviousHits) > self.logOnceMaxEntries:
+                del self.logLinePreviousHits[next(iter(self.logLinePreviousHits))]
+            return True
     
     # Log once per session. Only logs the first time called from a particular line number in the code.
-    def TraceOnce(self, logMsg = "", printTo = 0, logAlways = False, toAscii = None):
-        lineNo = inspect.currentframe().f_back.f_lineno
+    # If interval (or logOnceInterval) is set, logs again from the same line after that many seconds.
+    def TraceOnce(self, logMsg = "", printTo = 0, logAlways = False, toAscii = None, interval = None):
         if self.DEBUG_TRACING or logAlways:
-            FuncAndLineNo = f"{inspect.currentframe().f_back.f_code.co_name}:{lineNo}"
-            if FuncAndLineNo in self.logLinePreviousHits:
+            callerFrame = inspect.currentframe().f_back
+            if not self.isLogOnceDue(f"{callerFrame.f_code.co_name}:{callerFrame.f_lineno}", interval):
                 return
-            self.logLinePreviousHits.append(FuncAndLineNo)
-            self.Trace(logMsg, printTo, logAlways, lineNo, toAscii=toAscii)
+            self.Trace(logMsg, printTo, logAlways, callerFrame.f_lineno, toAscii=toAscii)
 
     # Log INFO on first call, then do Trace on remaining calls.
-    def LogOnce(self, logMsg = "", printTo = 0, logAlways = False, traceOnRemainingCalls = True, toAscii = None):
+    def LogOnce(self, logMsg = "", printTo = 0, logAlways = False, traceOnRemainingCalls = True, toAscii = None, interval = None):
         if printTo == 0: printTo = self.LOG_TO_FILE
-        lineNo = inspect.currentframe().f_back.f_lineno
-        FuncAndLineNo = f"{inspect.currentframe().f_back.f_code.co_name}:{lineNo}"
-        if FuncAndLineNo in self.logLinePreviousHits:
+        callerFrame = inspect.currentframe().f_back
+        lineNo = callerFrame.f_lineno
+        if not self.isLogOnceDue(f"{callerFrame.f_code.co_name}:{lineNo}", interval):
             if traceOnRemainingCalls:
                 self.Trace(logMsg, printTo, logAlways, lineNo, toAscii=toAscii) 
         else:
-            self.logLinePreviousHits.append(FuncAndLineNo)
             self.Log(logMsg, printTo, logging.INFO, lineNo, toAscii=toAscii)   
     
-    def Warn(self, logMsg, printTo = 0, toAscii = None):
+    def Warn(self, logMsg, printTo = 0, toAscii = None, logArgs = None):
         if printTo == 0: printTo = self.log_to_wrn_set
         lineNo = inspect.currentframe().f_back.f_lineno
-        self.Log(logMsg, printTo, logging.WARN, lineNo, toAscii=toAscii)
+        self.Log(logMsg, printTo, logging.WARN, lineNo, toAscii=toAscii, logArgs=logArgs)
     
-    def Error(self, logMsg, printTo = 0, toAscii = None):
+    def Error(self, logMsg, printTo = 0, toAscii = None, logArgs = None):
         if printTo == 0: printTo = self.log_to_err_set
         lineNo = inspect.currentframe().f_back.f_lineno
-        self.Log(logMsg, printTo, logging.ERROR, lineNo, toAscii=toAscii)
+        self.Log(logMsg, printTo, logging.ERROR, lineNo, toAscii=toAscii, logArgs=logArgs)
     
     def Status(self, printTo = 0, logLevel = logging.INFO, lineNo = -1):
         if printTo == 0: printTo = self.log_to_norm
@@ -307,31 +399,44 @@ class StashPluginHelper(StashInterface):
         self.Log(f"StashPluginHelper Status: (CALLED_AS_STASH_PLUGIN={self.CALLED_AS_STASH_PLUGIN}), (RUNNING_IN_COMMAND_LINE_MODE={self.RUNNING_IN_COMMAND_LINE_MODE}), (DEBUG_TRACING={self.DEBUG_TRACING}), (DRY_RUN={self.DRY_RUN}), (PLUGIN_ID={self.PLUGIN_ID}), (PLUGIN_TASK_NAME={self.PLUGIN_TASK_NAME}), (STASH_URL={self.STASH_URL}), (MAIN_SCRIPT_NAME={self.MAIN_SCRIPT_NAME})",
             printTo, logLevel, lineNo)
     
-    def ExecuteProcess(self, args, ExecDetach=False):
+    # When taskName is given, the process is tracked by processSupervisor: at most maxInstances processes of the task run at once
+    # (returns None instead of starting another one), stdout/stderr go to a rotating log file, and the exit code and times are logged.
+    def ExecuteProcess(self, args, ExecDetach=False, taskName=None, maxInstances=1, captureOutput=True):
         import platform, subprocess
         is_windows = any(platform.win32_ver())
-        pid = None
         self.Trace(f"is_windows={is_windows} args={args}")
+        popenArgs = {}
         if is_windows:
+            popenArgs['shell'] = True
             if ExecDetach:
                 self.Trace("Executing process using Windows DETACHED_PROCESS")
                 DETACHED_PROCESS = 0x00000008
-                pid = subprocess.Popen(args,creationflags=DETACHED_PROCESS, shell=True).pid
-            else:
-                pid = subprocess.Popen(args, shell=True).pid
+                popenArgs['creationflags'] = DETACHED_PROCESS
         else:
             self.Trace("Executing process using normal Popen")
-            pid = subprocess.Popen(args).pid
+        if taskName != None:
+            pid = self.processSupervisor.start(taskName, args, popenArgs, maxInstances, captureOutput)
+        else:
+            pid = subprocess.Popen(args, **popenArgs).pid
         self.Trace(f"pid={pid}")
         return pid
     
-    def ExecutePythonScript(self, args, ExecDetach=True):
+    def ExecutePythonScript(self, args, ExecDetach=True, taskName=None, maxInstances=1, captureOutput=True):
         PythonExe = f"{sys.executable}"
         argsWithPython = [f"{PythonExe}"] + args
-        return self.ExecuteProcess(argsWithPython,ExecDetach=ExecDetach)
+        return self.ExecuteProcess(argsWithPython,ExecDetach=ExecDetach, taskName=taskName, maxInstances=maxInstances, captureOutput=captureOutput)
     
-    def Submit(self, *args, **kwargs):
-        return self.thredPool.submit(*args, **kwargs)
+    # Runs a function in the thread pool. Tasks can be put in a named taskGroup, so they can be waited for or cancelled together,
+    # and their timing is summarized per group in the plugin log.
+    def Submit(self, *args, taskGroup = "default", **kwargs):
+        return self.thredPool.submit(*args, taskGroup=taskGroup, **kwargs)
+    
+    def WaitTasks(self, taskGroup = None, timeout = None):
+        return self.thredPool.wait(taskGroup, timeout)
+    
+    # Cancels the tasks not yet started, and stops accepting new tasks. Call when the plugin is stopping.
+    def StopTasks(self, wait = False):
+        self.thredPool.shutdown(wait=wait, cancelPending=True)
     
     def asc2(self, data, convertToAscii=None):
         if convertToAscii or (convertToAscii == None and self.convertToAscii):
@@ -397,18 +502,66 @@ class StashPluginHelper(StashInterface):
         result = self.call_GQL(query, variables)
         return result['findDuplicateScenes'] 
     
+    # Fetches scenes in batches of batchSize using findScenes(scene_ids). Much faster than calling find_scene for each scene.
+    def find_scenes_by_ids(self, sceneIDs, fragment='id', batchSize=500):
+        query = """
+            query FindScenesByIds($scene_ids: [Int!]) {
+                findScenes(scene_ids: $scene_ids, filter: {per_page: -1}) {
+                    scenes {
+                        ...SceneSlim
+                    }
+                }
+            }
+        """
+        query = re.sub(r'\.\.\.SceneSlim', fragment, query)
+        scenes = []
+        sceneIDs = [int(sceneID) for sceneID in sceneIDs]
+        for i in range(0, len(sceneIDs), batchSize):
+            result = self.call_GQL(query, {"scene_ids": sceneIDs[i:i+batchSize]})
+            scenes += result['findScenes']['scenes']
+        return scenes
+    
     # #################################################################################################
     # The below functions extends class StashInterface with functions which are not yet in the class
+    # Returns every scene in a single list. Use iter_scenes on large libraries, so scenes are fetched page by page.
     def get_all_scenes(self):
-        query_all_scenes = """
-            query AllScenes {
-                allScenes {
-                    id
-                    updated_at
-                }
+        return {'allScenes' : list(self.iter_scenes(fragment='id updated_at'))}
+    
+    # Yields the scenes matching scene filter f, fetching page_size scenes at a time.
+    # Pages are fetched in ID order, always asking for the scenes after the last ID received, so scenes added, removed or updated while iterating
+    # do not shift the pages, and no scene is skipped or returned twice.
+    def iter_scenes(self, f=None, fragment='id', page_size=1000):
+        sceneFilter = dict(f) if f else {}
+        lastId = 0
+        while True:
+            sceneFilter["id"] = {"value": lastId, "modifier": "GREATER_THAN"}
+            scenes = self.find_scenes(f=sceneFilter, filter={"page": 1, "per_page": page_size, "sort": "id", "direction": "ASC"}, fragment=fragment)
+            for scene in scenes:
+                yield scene
+            if len(scenes) < page_size:
+                return
+            lastId = int(scenes[-1]['id'])
+    
+    # Returns the most recently updated scene, or None if there are no scenes
+    def get_latest_updated_scene(self, fragment='id updated_at'):
+        scenes = self.find_scenes(filter={"page": 1, "per_page": 1, "sort": "updated_at", "direction": "DESC"}, fragment=fragment)
+        return scenes[0] if len(scenes) > 0 else None
+    
+    # Adds (mode="ADD"), removes (mode="REMOVE"), or sets (mode="SET") tags on many scenes with a single bulkSceneUpdate call
+    def bulk_update_scene_tags(self, sceneIDs:list, tagIDs:list, mode="ADD"):
+        query = """
+        mutation BulkSceneUpdate($input:BulkSceneUpdateInput!) {
+            bulkSceneUpdate(input: $input) {
+                id
             }
+        }
         """
-        return self.call_GQL(query_all_scenes)
+        bulk_scene_update_input = {
+            "ids": sceneIDs,
+            "tag_ids": {"ids": tagIDs, "mode": mode},
+        }
+        result = self.call_GQL(query, {"input": bulk_scene_update_input})
+        return result
     
     def metadata_autotag(self, paths:list=[], performers:list=[], studios:list=[], tags:list=[]):
         query = """
@@ -452,27 +605,271 @@ class StashPluginHelper(StashInterface):
     def rename_generated_files(self):
         return self.call_GQL("mutation MigrateHashNaming {migrateHashNaming}")
 
+class taskPool: # A thread pool with named task groups, a bounded queue, cancellation, and per-group task timing
+    stash = None
+    executor = None
+    slots = None
+    groups = None
+    stats = None
+    lock = None
+    stopping = False
+    
+    def __init__(self, stash, maxWorkers=2, maxQueued=0):
+        self.stash = stash
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix=stash.PLUGIN_ID)
+        self.slots = threading.BoundedSemaphore(maxWorkers + maxQueued) if maxQueued > 0 else None
+        self.groups = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+    
+    # Blocks while the queue is full (backpressure). Raises queue.Full if no slot frees up within timeout seconds.
+    def submit(self, fn, *args, taskGroup="default", timeout=None, **kwargs):
+        if self.stopping:
+            raise RuntimeError(f"Can not submit task to group {taskGroup}, because the task pool is stopping.")
+        if self.slots != None and not self.slots.acquire(timeout=timeout):
+            raise queue.Full(f"Task pool queue is full. Could not submit task to group {taskGroup}.")
+        try:
+            future = self.executor.submit(self.run, taskGroup, fn, args, kwargs)
+        except Exception:
+            if self.slots != None: self.slots.release()
+            raise
+        with self.lock:
+            self.groups.setdefault(taskGroup, set()).add(future)
+        future.add_done_callback(lambda future: self.taskDone(taskGroup, future))
+        return future
+    
+    def run(self, taskGroup, fn, args, kwargs):
+        startTime = time.perf_counter()
+        startCpu = time.thread_time()
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            wallTime = time.perf_counter() - startTime
+            cpuTime = time.thread_time() - startCpu
+            with self.lock:
+                stats = self.stats.setdefault(taskGroup, {'count' : 0, 'failed' : 0, 'wallTime' : 0.0, 'maxWallTime' : 0.0, 'cpuTime' : 0.0})
+                stats['count'] += 1
+                stats['failed'] += 1 if failed else 0
+                stats['wallTime'] += wallTime
+                stats['maxWallTime'] = max(stats['maxWallTime'], wallTime)
+                stats['cpuTime'] += cpuTime
+            self.stash.Trace(lambda: f"Task {getattr(fn, '__name__', fn)} in group {taskGroup} took {wallTime:.3f}s (CPU {cpuTime:.3f}s){' and failed' if failed else ''}")
+    
+    def taskDone(self, taskGroup, future):
+        with self.lock:
+            self.groups.get(taskGroup, set()).discard(future)
+        if self.slots != None:
+            self.slots.release()
+    
+    def futures(self, taskGroup=None):
+        with self.lock:
+            if taskGroup != None:
+                return list(self.groups.get(taskGroup, set()))
+            return [future for futures in self.groups.values() for future in futures]
+    
+    def wait(self, taskGroup=None, timeout=None):
+        return concurrent.futures.wait(self.futures(taskGroup), timeout=timeout)
+    
+    # Cancels the tasks which have not started. Returns the quantity cancelled.
+    def cancel(self, taskGroup=None):
+        return sum(1 for future in self.futures(taskGroup) if future.cancel())
+    
+    def shutdown(self, wait=True, cancelPending=False):
+        if self.stopping:
+            return
+        self.stopping = True
+        if cancelPending:
+            QtyCancelled = self.cancel()
+            if QtyCancelled > 0:
+                self.stash.Log(f"Cancelled {QtyCancelled} pending tasks.")
+        self.executor.shutdown(wait=wait)
+        self.logStats()
+    
+    def logStats(self):
+        with self.lock:
+            for taskGroup, stats in self.stats.items():
+                self.stash.Log(f"Task group {taskGroup}: count={stats['count']}, failed={stats['failed']}, average={stats['wallTime'] / stats['count']:.3f}s, max={stats['maxWallTime']:.3f}s, CPU={stats['cpuTime']:.3f}s", printTo=self.stash.LOG_TO_FILE)
+
+class processSupervisor: # Tracks the processes started by ExecuteProcess for each task name
+    stash = None
+    logDir = None
+    runningFile = None
+    maxLogBytes = 1024*1024
+    logBackupCount = 2
+    running = None
+    previousRunning = None
+    lock = None
+    
+    def __init__(self, stash, maxLogBytes=1024*1024, logBackupCount=2):
+        self.stash = stash
+        self.logDir = f"{stash.LOG_FILE_DIR}{os.sep}ProcessLogs"
+        self.runningFile = f"{self.logDir}{os.sep}running.json" # The running processes, so they are still counted after the plugin restarts
+        self.maxLogBytes = maxLogBytes
+        self.logBackupCount = logBackupCount
+        self.running = {} # taskName -> list of running Popen
+        self.previousRunning = None # taskName -> list of {'pid', 'started'} started by a previous instance of the plugin. Loaded from runningFile on first use.
+        self.lock = threading.Lock()
+    
+    # Returns True if the process is still running. If psutil is installed, a process ID reused by another process is detected by its creation time.
+    def isAlive(self, pid, started):
+        try:
+            import psutil
+            try:
+                return abs(psutil.Process(pid).create_time() - started) < 5
+            except psutil.NoSuchProcess:
+                return False
+            except psutil.AccessDenied:
+                return True
+        except ImportError:
+            pass
+        if os.name == 'nt':
+            import ctypes
+            handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+            if not handle:
+                return False
+            try:
+                exitCode = ctypes.c_ulong()
+                ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exitCode))
+                return exitCode.value == 259 # STILL_ACTIVE
+            finally:
+                ctypes.windll.kernel32.CloseHandle(handle)
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+    
+    # The following functions must be called while holding self.lock
+    def loadPreviousRunning(self):
+        if self.previousRunning != None:
+            return
+        try:
+            with open(self.runningFile, 'r', encoding='utf-8') as f:
+                self.previousRunning = json.load(f)
+        except (OSError, ValueError):
+            self.previousRunning = {}
+    
+    def saveRunning(self):
+        data = {}
+        for taskName, entries in self.previousRunning.items():
+            data.setdefault(taskName, []).extend(entries)
+        for taskName, processes in self.running.items():
+            data.setdefault(taskName, []).extend([{'pid' : process.pid, 'started' : process.startTime} for process in processes])
+        data = {taskName : entries for taskName, entries in data.items() if len(entries) > 0}
+        try:
+            os.makedirs(self.logDir, exist_ok=True)
+            tmpFile = f"{self.runningFile}.{os.getpid()}.tmp"
+            with open(tmpFile, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmpFile, self.runningFile)
+        except OSError as e:
+            self.stash.Trace(f"Could not save {self.runningFile}. Error: {e}")
+    
+    def countRunning(self, taskName):
+        self.loadPreviousRunning()
+        self.previousRunning[taskName] = [entry for entry in self.previousRunning.get(taskName, []) if self.isAlive(entry['pid'], entry['started'])]
+        return len(self.running.get(taskName, [])) + len(self.previousRunning[taskName])
+    
+    def logFileName(self, taskName):
+        return f"{self.logDir}{os.sep}{re.sub(r'[^0-9A-Za-z_.-]', '_', taskName)[-100:]}.log"
+    
+    # Renames TaskName.log to TaskName.log.1 (and so on) when it is larger than maxLogBytes
+    def rotateLog(self, logFile):
+        if not os.path.isfile(logFile) or os.path.getsize(logFile) < self.maxLogBytes:
+            return
+        for i in range(self.logBackupCount - 1, 0, -1):
+            if os.path.isfile(f"{logFile}.{i}"):
+                os.replace(f"{logFile}.{i}", f"{logFile}.{i + 1}")
+        os.replace(logFile, f"{logFile}.1")
+    
+    # Waits in a background thread for the process to exit, then logs its exit code, wall time and CPU time
+    def watch(self, taskName, process, startTime, logFile):
+        cpuTime = None
+        if hasattr(os, 'wait4'):
+            try:
+                pid, status, rusage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+                cpuTime = rusage.ru_utime + rusage.ru_stime
+            except ChildProcessError:
+                process.wait()
+        else:
+            process.wait()
+        wallTime = time.time() - startTime
+        if logFile != None:
+            logFile.close()
+        with self.lock:
+            self.running[taskName].remove(process)
+            self.saveRunning()
+        cpuStr = f"{cpuTime:.2f}s" if cpuTime != None else "unknown"
+        self.stash.Log(f"Process {process.pid} of task {taskName} exited with code {process.returncode}; wall time={wallTime:.2f}s, CPU time={cpuStr}",
+                       logLevel=logging.INFO if process.returncode == 0 else logging.WARN, printTo=self.stash.LOG_TO_FILE)
+    
+    def qtyRunning(self, taskName):
+        with self.lock:
+            return self.countRunning(taskName)
+    
+    def start(self, taskName, args, popenArgs, maxInstances=1, captureOutput=True):
+        import subprocess
+        # The lock is held from the running check until the process is added, so two triggers of the same task can not both start it
+        with self.lock:
+            qtyRunning = self.countRunning(taskName)
+            if maxInstances > 0 and qtyRunning >= maxInstances:
+                self.stash.Warn(f"Skipping task {taskName}, because {qtyRunning} instance(s) from a previous run are still running.", printTo=self.stash.LOG_TO_FILE)
+                return None
+            logFile = None
+            if captureOutput:
+                os.makedirs(self.logDir, exist_ok=True)
+                logFileName = self.logFileName(taskName)
+                try:
+                    self.rotateLog(logFileName)
+                except OSError as e: # The log file can be open by another instance of the task
+                    self.stash.Trace(f"Could not rotate {logFileName}. Error: {e}")
+                logFile = open(logFileName, 'ab')
+                logFile.write(f"\n##### {time.strftime('%Y-%m-%d %H:%M:%S')} {args}\n".encode('utf-8'))
+                logFile.flush()
+                popenArgs = dict(popenArgs, stdout=logFile, stderr=subprocess.STDOUT)
+            try:
+                process = subprocess.Popen(args, **popenArgs)
+            except Exception:
+                if logFile != None:
+                    logFile.close()
+                raise
+            process.startTime = time.time()
+            self.running.setdefault(taskName, []).append(process)
+            self.saveRunning()
+        threading.Thread(target=self.watch, args=(taskName, process, process.startTime, logFile), daemon=True).start()
+        return process.pid
+
 class mergeMetadata: # A class to merge scene metadata from source scene to destination scene
     srcData = None
     destData = None
     stash = None
     excludeMergeTags = None
     dataDict = None
+    mergedData = None # Destination fields after the update. Copied to destData once the scene is updated, so merging more duplicates into the same scene keeps the merged items.
     result = "Nothing To Merge"
     def __init__(self, stash, excludeMergeTags=None):
         self.stash = stash
-        self.excludeMergeTags = excludeMergeTags
+        self.excludeMergeTags = set(excludeMergeTags) if excludeMergeTags else None
     
     def merge(self, SrcData, DestData):
         self.srcData = SrcData
         self.destData = DestData
         ORG_DATA_DICT = {'id' : self.destData['id']}
         self.dataDict = ORG_DATA_DICT.copy()
-        self.mergeItems('tags', 'tag_ids', [], excludeName=self.excludeMergeTags)
-        self.mergeItems('performers', 'performer_ids', [])
-        self.mergeItems('galleries', 'gallery_ids', [])
-        self.mergeItems('movies', 'movies', [])
-        self.mergeItems('urls', listToAdd=self.destData['urls'], NotStartWith=self.stash.STASH_URL)
+        self.mergedData = {}
+        self.result = "Nothing To Merge"
+        self.mergeItems('tags', 'tag_ids', excludeName=self.excludeMergeTags)
+        self.mergeItems('performers', 'performer_ids')
+        self.mergeItems('galleries', 'gallery_ids')
+        self.mergeItems('movies', 'movies')
+        self.mergeItems('urls', NotStartWith=self.stash.STASH_URL)
         self.mergeItem('studio', 'studio_id', 'id')
         self.mergeItem('title')
         self.mergeItem('director')
@@ -483,6 +880,7 @@ class mergeMetadata: # A class to merge scene metadata from source scene to dest
         if self.dataDict != ORG_DATA_DICT:
             self.stash.Trace(f"Updating scene ID({self.destData['id']}) with {self.dataDict}; path={self.destData['files'][0]['path']}", toAscii=True)
             self.result = self.stash.update_scene(self.dataDict)
+            self.destData.update(self.mergedData)
         return self.result
     
     def Nothing(self, Data):
@@ -498,29 +896,41 @@ class mergeMetadata: # A class to merge scene metadata from source scene to dest
                 self.dataDict.update({ updateFieldName : self.srcData[fieldName]})
             else:
                 self.dataDict.update({ updateFieldName : self.srcData[fieldName][subField]})
-    def mergeItems(self, fieldName, updateFieldName=None, listToAdd=[], NotStartWith=None, excludeName=None):
-        dataAdded = ""
+            self.mergedData[fieldName] = self.srcData[fieldName]
+    
+    # Key used to compare the items of a field. Movies are compared by movie ID, urls by value, and other fields by ID.
+    def itemKey(self, fieldName, item):
+        if fieldName == 'movies':
+            return item['movie']['id']
+        if fieldName == 'urls':
+            return item
+        return item['id']
+    
+    # Value of an item in the scene update
+    def updateItem(self, fieldName, item):
+        if fieldName == 'movies':
+            return {"movie_id" : item['movie']['id'], "scene_index" : item['scene_index']}
+        if fieldName == 'urls':
+            return item
+        return item['id']
+    
+    # Adds the source items missing from the destination. The destination items are put in a set, so each source item is checked in constant time.
+    def mergeItems(self, fieldName, updateFieldName=None, NotStartWith=None, excludeName=None):
+        if updateFieldName == None:
+            updateFieldName = fieldName
+        destKeys = {self.itemKey(fieldName, item) for item in self.destData[fieldName]}
+        listToAdd = []
         for item in self.srcData[fieldName]:
-            if item not in self.destData[fieldName]:
-                if NotStartWith == None or not item.startswith(NotStartWith):
-                    if excludeName == None or item['name'] not in excludeName:
-                        if fieldName == 'movies':
-                            listToAdd += [{"movie_id" : item['movie']['id'], "scene_index" : item['scene_index']}]
-                            dataAdded += f"{item['movie']['id']} "                    
-                        elif updateFieldName == None:
-                            listToAdd += [item]
-                            dataAdded += f"{item} "
-                        else:
-                            listToAdd += [item['id']]
-                            dataAdded += f"{item['id']} "
-        if dataAdded != "":
-            if updateFieldName == None:
-                updateFieldName = fieldName
-            else:
-                for item in self.destData[fieldName]:
-                    if fieldName == 'movies':
-                        listToAdd += [{"movie_id" : item['movie']['id'], "scene_index" : item['scene_index']}]
-                    else:
-                        listToAdd += [item['id']]
-            self.dataDict.update({ updateFieldName : listToAdd})
-            # self.stash.Trace(f"Added {fieldName} ({dataAdded}) to scene ID({self.destData['id']})", toAscii=True)
+            key = self.itemKey(fieldName, item)
+            if key in destKeys:
+                continue
+            if NotStartWith != None and item.startswith(NotStartWith):
+                continue
+            if excludeName != None and item['name'] in excludeName:
+                continue
+            destKeys.add(key)
+            listToAdd += [item]
+        if len(listToAdd) > 0:
+            self.mergedData[fieldName] = self.destData[fieldName] + listToAdd
+            self.dataDict.update({ updateFieldName : [self.updateItem(fieldName, item) for item in self.mergedData[fieldName]]})
+            # self.stash.Trace(f"Added {fieldName} ({listToAdd}) to scene ID({self.destData['id']})", toAscii=True)
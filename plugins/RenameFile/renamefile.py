@@ -13,15 +13,6 @@ from renamefile_settings import config # Import settings from renamefile_setting
 # Constant global variables --------------------------------------------
 DEFAULT_FIELD_KEY_LIST = "title,performers,studio,tags" # Default Field Key List with the desired order
 DEFAULT_SEPERATOR = "-"
-# GraphQL query to fetch all scenes
-QUERY_ALL_SCENES = """
-    query AllScenes {
-        allScenes {
-            id
-            updated_at
-        }
-    }
-"""
 # **********************************************************************
 # Global variables          --------------------------------------------
 inputToUpdateScenePost = False
@@ -322,13 +313,11 @@ def rename_scene(scene_id):
     return new_filename 
     
 def rename_files_task():
-    scene_result = stash.get_all_scenes()
-    all_scenes = scene_result['allScenes']
-    if not all_scenes:
+    # Find the scene with the latest updated_at timestamp
+    latest_scene = stash.get_latest_updated_scene()
+    if not latest_scene:
         stash.Error("No scenes found.")
         exit()
-    # Find the scene with the latest updated_at timestamp
-    latest_scene = max(all_scenes, key=lambda scene: scene['updated_at'])
     # Extract the ID of the latest scene
     latest_scene_id = latest_scene.get('id')
     # Rename the latest scene and trigger metadata scan
@@ -47,4 +47,6 @@ config = {
     "if_notitle_use_org_filename": True, # Warning: Do not recommend setting this to False.
     # Current Stash DB schema only allows maximum base file name length to be 255
     "max_filename_length": 255,
+    # Seconds the Stash configuration fetched at startup is saved and shared with the other plugins using StashPluginHelper (FileMonitor, DupFileManager, RenameFile). The saved copy includes the Stash API key. 0 = Disabled
+    "configSnapshotTTL" : 0,
 }
@@ -5,6 +5,9 @@ import sys
 import requests
 import json
 import time
+import gzip
+import concurrent.futures
+from datetime import datetime
 import math
 import uuid
 from pathlib import Path
@@ -14,9 +17,24 @@ import shutil
 import re
 
 per_page = 100
+submit_workers = 4
+submit_retries = 5
+submit_server_retries = 2
+compress_submissions = True
 request_s = requests.Session()
 scrapers = {}
 tags_cache = {}
+plugin_tags = [
+    "[Timestamp]",
+    "[Timestamp: Auto Gallery]",
+    "[Timestamp: Cover]",
+    "[Timestamp: Gallery Image]",
+    "[Timestamp: Skip Submit]",
+    "[Timestamp: Skip Sync]",
+    "[Timestamp: Tag Gallery]",
+]
+performers_cache = {}
+own_updates = {}
 
 
 def processScene(s):
@@ -408,7 +426,19 @@ def processSceneTimestamTrade(s):
 
                     if needs_update:
                         log.debug("updating scene: %s" % (new_scene,))
-                        stash.update_scene(new_scene)
+                        updateScene(new_scene)
+
+
+def updateScene(new_scene):
+    """
+    Update a scene and remember the updated_at the update gave it, so the next
+    incremental processAll run can skip scenes whose only change was our own.
+    """
+    res = stash.call_GQL(
+        "mutation SceneUpdate($input: SceneUpdateInput!) { sceneUpdate(input: $input) { id updated_at } }",
+        {"input": new_scene},
+    )
+    own_updates[str(res["sceneUpdate"]["id"])] = res["sceneUpdate"]["updated_at"]
 
 
 def processSceneStashid(s):
@@ -447,7 +477,7 @@ def processSceneStashid(s):
                         "https://timestamp.trade/scene/%s" % (md["scene_id"],)
                     )
                     log.debug("new scene update: %s" % (new_scene,))
-                    stash.update_scene(new_scene)
+                    updateScene(new_scene)
                 else:
                     s["urls"].append(
                         "https://timestamp.trade/scene/%s" % (md["scene_id"],)
@@ -457,36 +487,107 @@ def processSceneStashid(s):
             log.error("api returned invalid JSON for stash id: " + sid["stash_id"])
 
 
-def processAll(query):
+def processAll(query, job, watermark=None, full_resync=False):
+    """
+    Process all scenes matching query.
+    If watermark is set only scenes updated since the last successful run under
+    that name are visited, the high-water mark is stored once the run completes.
+    full_resync ignores the stored high-water mark and visits every scene.
+    Scenes last updated by the plugin itself during the previous run are skipped.
+    """
+    previous_updates = {}
+    if watermark:
+        state = getSyncState(watermark)
+        if state and not full_resync:
+            log.info(
+                "processing scenes updated since last sync at %s"
+                % (state["updated_at"],)
+            )
+            query = dict(query)
+            query["updated_at"] = {
+                "value": state["updated_at"],
+                "modifier": "GREATER_THAN",
+            }
+            previous_updates = state.get("own_updates", {})
+        elif full_resync:
+            log.info("full resync requested, processing all scenes")
+
+    def process(s):
+        if s.get("updated_at") and previous_updates.get(str(s["id"])) == s["updated_at"]:
+            log.debug("scene %s only changed by the last sync, skipping" % (s["id"],))
+            return False
+        processScene(s)
+
     log.debug(query)
-    log.info("Getting scene count")
-    count = stash.find_scenes(
-        f=query,
-        filter={"per_page": 1},
-        get_count=True,
-    )[0]
-    log.info(str(count) + " scenes to process.")
-    #    i = 0
-    # 98
-    for r in range(1, int(count / per_page) + 2):
-        i = (r - 1) * per_page
+    run_started = runJob(job, stash.find_scenes, query, process, delay=2)
+    if watermark:
+        # scenes updated while this run was in progress are picked up next time,
+        # unless the update was made by this run
+        setSyncState(
+            watermark, {"updated_at": run_started, "own_updates": own_updates}
+        )
+
+
+def runJob(job, find, query, process, delay=0):
+    """
+    Call process for every item matching query exactly once.
+    Items are fetched in id order, always asking for the first page of items
+    with an id above the last processed one, so items entering or leaving the
+    result set while the job runs do not shift the pages. The last processed id
+    is checkpointed in sync_state and an interrupted job resumes after it, as
+    long as it is run again with the same query.
+    The delay is not applied after items process skipped by returning False.
+    Returns the time the job was first started.
+    """
+    checkpoint = "job:%s" % (job,)
+    query_hash = hashlib.sha256(
+        json.dumps(query, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    conn = db_migrations()
+    state = getSyncState(checkpoint, conn)
+    if state and state.get("query") != query_hash:
+        log.info("job %s was interrupted with a different query, restarting" % (job,))
+        state = None
+    if state:
+        log.info("resuming job %s after id %s" % (job, state["last_id"]))
+    else:
+        state = {
+            "last_id": 0,
+            "query": query_hash,
+            "started": datetime.now().astimezone().isoformat(timespec="seconds"),
+        }
+    cursor_query = dict(query)
+    cursor_query["id"] = {"value": state["last_id"], "modifier": "GREATER_THAN"}
+    count = find(f=cursor_query, filter={"per_page": 1}, get_count=True)[0]
+    log.info("%s items to process." % (count,))
+    i = 0
+    while True:
+        items = find(
+            f=cursor_query,
+            filter={"page": 1, "per_page": per_page, "sort": "id", "direction": "ASC"},
+        )
+        if len(items) == 0:
+            break
         log.info(
             "fetching data: %s - %s %0.1f%%"
             % (
-                (r - 1) * per_page,
-                r * per_page,
-                (i / count) * 100,
+                i,
+                i + len(items),
+                (i / max(count, 1)) * 100,
             )
         )
-        scenes = stash.find_scenes(
-            f=query,
-            filter={"page": r, "per_page": per_page},
-        )
-        for s in scenes:
-            processScene(s)
+        for item in items:
+            skipped = process(item) is False
+            state["last_id"] = int(item["id"])
+            setSyncState(checkpoint, state, conn)
             i = i + 1
-            log.progress((i / count))
-            time.sleep(2)
+            log.progress(min(i / max(count, 1), 1))
+            if delay and not skipped:
+                time.sleep(delay)
+        cursor_query["id"]["value"] = state["last_id"]
+    clearSyncState(checkpoint, conn)
+    conn.close()
+    return state["started"]
 
 
 def submitScene(query):
@@ -678,44 +779,147 @@ def submitScene(query):
         }"""
 
     count = stash.find_scenes(f=query, filter={"per_page": 1}, get_count=True)[0]
+    conn = db_migrations()
+    cur = conn.cursor()
     i = 0
-    for r in range(1, math.ceil(count / per_page) + 1):
-        log.info(
-            "submitting scenes: %s - %s %0.1f%%"
-            % (
-                (r - 1) * per_page,
-                r * per_page,
-                (i / count) * 100,
+    skipped = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=submit_workers) as executor:
+        for r in range(1, math.ceil(count / per_page) + 1):
+            log.info(
+                "submitting scenes: %s - %s %0.1f%%"
+                % (
+                    (r - 1) * per_page,
+                    r * per_page,
+                    (i / count) * 100,
+                )
+            )
+            scenes = stash.find_scenes(
+                f=query, filter={"page": r, "per_page": per_page}, fragment=scene_fgmt
             )
-        )
-        scenes = stash.find_scenes(
-            f=query, filter={"page": r, "per_page": per_page}, fragment=scene_fgmt
-        )
-        for s in scenes:
-            log.debug("submitting scene: " + str(s))
             if settings["submitFunscriptHash"]:
-                log.debug(s)
-                s["funscriptHashes"] = []
-                conn = db_migrations()
-                cur = conn.cursor()
+                # one query per page instead of one connection per scene
+                funscripts = {s["id"]: [] for s in scenes}
                 res = cur.execute(
-                    "select id,filename,metadata,scene_id,md5 from script_index where scene_id=?",
-                    (s["id"],),
+                    "select id,filename,metadata,scene_id,md5 from script_index where scene_id in (%s)"
+                    % (",".join("?" * len(funscripts)),),
+                    list(funscripts.keys()),
                 )
                 for row in res.fetchall():
-                    s["funscriptHashes"].append(
+                    funscripts[row[3]].append(
                         {
                             "filename": str(Path(row[1]).name),
                             "metadata": json.loads(row[2]),
                             "md5": row[4],
                         }
                     )
-            s.pop("id")
-            log.debug(s)
-            request_s.post("https://timestamp.trade/submit-stash", json=s)
-            i = i + 1
-            log.progress((i / count))
-            time.sleep(0.5)
+                for s in scenes:
+                    s["funscriptHashes"] = funscripts[s["id"]]
+
+            # serialise, hash and compress the payloads in the worker pool
+            payloads = list(executor.map(prepareSubmission, scenes))
+            ledger = {}
+            res = cur.execute(
+                "select scene_id,hash from submit_ledger where scene_id in (%s)"
+                % (",".join("?" * len(payloads)),),
+                [x["scene_id"] for x in payloads],
+            )
+            for row in res.fetchall():
+                ledger[row[0]] = row[1]
+
+            futures = {}
+            for payload in payloads:
+                if ledger.get(payload["scene_id"]) == payload["hash"]:
+                    log.debug("scene %s unchanged, skipping" % (payload["scene_id"],))
+                    skipped = skipped + 1
+                    i = i + 1
+                    continue
+                future = executor.submit(
+                    postSubmission, "https://timestamp.trade/submit-stash", payload
+                )
+                futures[future] = payload
+            for future in concurrent.futures.as_completed(futures):
+                payload = futures[future]
+                if future.result():
+                    cur.execute(
+                        "insert or replace into submit_ledger (scene_id,hash,submitted) values (?,?,datetime('now'))",
+                        (payload["scene_id"], payload["hash"]),
+                    )
+                i = i + 1
+                log.progress((i / count))
+            conn.commit()
+    conn.close()
+    log.info("finished submitting scenes, %s unchanged scenes skipped" % (skipped,))
+
+
+def prepareSubmission(s):
+    scene_id = s.pop("id")
+    log.debug("submitting scene: " + str(s))
+    body = json.dumps(s, sort_keys=True).encode("utf-8")
+    return {
+        "scene_id": scene_id,
+        "hash": hashlib.sha256(body).hexdigest(),
+        "body": body,
+        "gzip_body": gzip.compress(body),
+    }
+
+
+def postSubmission(url, payload):
+    """
+    Post a prepared payload, retrying with exponential backoff on connection
+    errors and rate limiting, server errors are retried at most
+    submit_server_retries times. A gzipped payload the api rejects is sent once
+    more uncompressed. Returns True if the api accepted it.
+    """
+    global compress_submissions
+    use_gzip = compress_submissions
+    server_errors = 0
+    for attempt in range(submit_retries):
+        use_gzip = use_gzip and compress_submissions
+        headers = {"Content-Type": "application/json"}
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            body = payload["gzip_body"]
+        else:
+            body = payload["body"]
+        delay = 2**attempt
+        try:
+            res = request_s.post(url, data=body, headers=headers)
+            if res.status_code in (400, 415) and use_gzip:
+                # other workers may have sent gzip before compression was disabled
+                if compress_submissions:
+                    log.info("api does not accept compressed submissions, disabling")
+                    compress_submissions = False
+                use_gzip = False
+                continue
+            if res.status_code < 300:
+                return True
+            if res.status_code != 429 and res.status_code < 500:
+                log.warning(
+                    "submission of scene %s rejected: %s"
+                    % (
+                        payload["scene_id"],
+                        res.status_code,
+                    )
+                )
+                return False
+            if res.status_code >= 500:
+                server_errors = server_errors + 1
+                if server_errors > submit_server_retries:
+                    log.error(
+                        "giving up submitting scene %s, server error: %s"
+                        % (
+                            payload["scene_id"],
+                            res.status_code,
+                        )
+                    )
+                    return False
+            if "Retry-After" in res.headers and res.headers["Retry-After"].isdigit():
+                delay = int(res.headers["Retry-After"])
+        except requests.RequestException as e:
+            log.debug("submission of scene %s failed: %s" % (payload["scene_id"], e))
+        time.sleep(delay)
+    log.error("giving up submitting scene %s" % (payload["scene_id"],))
+    return False
 
 
 def submitGallery():
@@ -777,9 +981,7 @@ def submitGallery():
       }
     }"""
 
-    skip_submit_tag_id = stash.find_tag("[Timestamp: Skip Submit]", create=True).get(
-        "id"
-    )
+    skip_submit_tag_id = getTag("[Timestamp: Skip Submit]")
     count = stash.find_galleries(
         f={
             "url": {"value": "", "modifier": "NOT_NULL"},
@@ -832,53 +1034,17 @@ def submitGallery():
 
 
 def processGalleries():
-    skip_sync_tag_id = stash.find_tag("[Timestamp: Skip Sync]", create=True).get("id")
-
-    count = stash.find_galleries(
-        f={
-            "url": {"value": "", "modifier": "IS_NULL"},
-            "tags": {
-                "depth": 0,
-                "excludes": [skip_sync_tag_id],
-                "modifier": "INCLUDES_ALL",
-                "value": [],
-            },
+    skip_sync_tag_id = getTag("[Timestamp: Skip Sync]")
+    query = {
+        "url": {"value": "", "modifier": "IS_NULL"},
+        "tags": {
+            "depth": 0,
+            "excludes": [skip_sync_tag_id],
+            "modifier": "INCLUDES_ALL",
+            "value": [],
         },
-        filter={"per_page": 1},
-        get_count=True,
-    )[0]
-    tag_cache = {}
-
-    log.info("count %s " % (count,))
-    i = 0
-    for r in range(1, math.ceil(count / per_page) + 1):
-        log.info(
-            "processing gallery scenes: %s - %s %0.1f%%"
-            % (
-                (r - 1) * per_page,
-                r * per_page,
-                (i / count) * 100,
-            )
-        )
-        galleries = stash.find_galleries(
-            f={
-                "url": {"value": "", "modifier": "IS_NULL"},
-                "tags": {
-                    "depth": 0,
-                    "excludes": [skip_sync_tag_id],
-                    "modifier": "INCLUDES_ALL",
-                    "value": [],
-                },
-            },
-            filter={
-                "page": r,
-                "per_page": 20,
-                "sort": "created_at",
-                "direction": "DESC",
-            },
-        )
-        for gal in galleries:
-            processGallery(gal)
+    }
+    runJob("processGalleries", stash.find_galleries, query, processGallery)
 
 
 def processGallery(gallery):
@@ -892,9 +1058,7 @@ def processGallery(gallery):
             stash.metadata_scan(paths=[settings["path"]])
             return
     # Process the gallery if it has the [Timestamp: Tag Gallery] tag
-    tag_gallery_tag_id = stash.find_tag("[Timestamp: Tag Gallery]", create=True).get(
-        "id"
-    )
+    tag_gallery_tag_id = getTag("[Timestamp: Tag Gallery]")
     if tag_gallery_tag_id in gallery["tags"]:
         process = True
     if process:
@@ -922,6 +1086,7 @@ def processGallery(gallery):
                                 "scene_ids": [],
                                 "details": g["description"],
                             }
+                            resolvePerformers([p["name"] for p in g["performers"]])
                             for p in g["performers"]:
                                 performer_id = None
                                 # try looking up stashid
@@ -943,14 +1108,9 @@ def processGallery(gallery):
                                         break
                                 # look for the performer
                                 if not performer_id:
-                                    performers = stash.find_performers(q=p["name"])
-                                    for perf in performers:
-                                        if p["name"].lower() == perf["name"].lower():
-                                            performer_id = perf["id"]
-                                        for pa in perf["alias_list"]:
-                                            if p["name"].lower() == pa.lower():
-                                                performer_id = perf["id"]
-                                                log.debug("match alias")
+                                    performer_ids = getPerformerIds(p["name"])
+                                    if len(performer_ids) > 0:
+                                        performer_id = performer_ids[0]
 
                                 # performer does not exist, create the performer
                                 if not performer_id:
@@ -965,6 +1125,7 @@ def processGallery(gallery):
                                         }
                                     )
                                     performer_id = new_perf["id"]
+                                    performers_cache[p["name"].lower()] = [performer_id]
                                     log.debug(new_perf)
                                 new_gallery["performer_ids"].append(performer_id)
                                 log.debug(performer_id)
@@ -1030,6 +1191,8 @@ def downloadGallery(gallery):
                     return
                 log.info("Processing auto Gallery")
                 counts = {"gallery": 1, "cover": 1}
+                # resolve all performer names of the scene up front, one query per batch
+                resolvePerformers([p["name"] for p in data["performers"]])
                 for i in data["images"]:
 
                     log.debug(i)
@@ -1071,9 +1234,9 @@ def downloadGallery(gallery):
                             )
                         else:
                             for p in data["performers"]:
-                                perf = stash.find_performers(q=p["name"])
-                                for p1 in perf:
-                                    image_data["performer_ids"].append(p1["id"])
+                                image_data["performer_ids"].extend(
+                                    getPerformerIds(p["name"])
+                                )
 
                         log.debug(image_data)
                         log.info(
@@ -1103,9 +1266,9 @@ def downloadGallery(gallery):
                             needs_update = True
                             for p in data["performers"]:
                                 log.debug(p["name"])
-                                perf = stash.find_performers(q=p["name"])
-                                for p1 in perf:
-                                    new_image["performer_ids"].append(p1["id"])
+                                new_image["performer_ids"].extend(
+                                    getPerformerIds(p["name"])
+                                )
 
                         if needs_update:
                             log.debug(new_image)
@@ -1125,32 +1288,7 @@ def reDownloadGallery():
             "value": [getTag("[Timestamp: Auto Gallery]")],
         }
     }
-    log.info("Getting gallery count")
-    count = stash.find_galleries(
-        f=query,
-        filter={"per_page": 1},
-        get_count=True,
-    )[0]
-    log.info(str(count) + " galleries to process.")
-    for r in range(1, int(count / per_page) + 2):
-        i = (r - 1) * per_page
-        log.info(
-            "fetching data: %s - %s %0.1f%%"
-            % (
-                (r - 1) * per_page,
-                r * per_page,
-                (i / count) * 100,
-            )
-        )
-        galleries = stash.find_galleries(
-            f=query,
-            filter={"page": r, "per_page": per_page},
-        )
-        for g in galleries:
-            downloadGallery(g)
-            i = i + 1
-            log.progress((i / count))
-            time.sleep(2)
+    runJob("reDownloadGallery", stash.find_galleries, query, downloadGallery, delay=2)
 
 
 def getImages(gallery_id):
@@ -1174,12 +1312,96 @@ def getImages(gallery_id):
 
 
 def getTag(name):
+    if len(tags_cache) == 0:
+        loadTags()
     if name not in tags_cache:
         tag = stash.find_tag(name, create=True)
         tags_cache[name] = tag.get("id")
+        setSyncState(tags_state, tags_cache)
     return tags_cache[name]
 
 
+def loadTags():
+    """
+    Fill tags_cache with the ids of the plugin's own tags.
+    The ids are stored in sync_state per server so later runs, including every
+    hook invocation, skip the lookups by name. The stored ids are checked with
+    one query by id, if a tag was deleted or recreated since, or nothing is
+    stored yet, all tags are resolved with one query and only the missing ones
+    are created.
+    """
+    state = getSyncState(tags_state)
+    if state:
+        res = stash.call_GQL(
+            "query FindTags($ids: [ID!]) { findTags(ids: $ids, filter: {per_page: -1}) { tags { id name } } }",
+            {"ids": list(state.values())},
+        )
+        found = {tag["name"]: tag["id"] for tag in res["findTags"]["tags"]}
+        if all(found.get(name) == str(id) for name, id in state.items()):
+            tags_cache.update(state)
+            return
+        log.info("cached tag ids are stale, resolving them again")
+    pattern = "^(%s)$" % (
+        "|".join(re.sub(r"([\\.+*?()|\[\]{}^$])", r"\\\1", n) for n in plugin_tags),
+    )
+    tags = stash.find_tags(
+        f={"name": {"value": pattern, "modifier": "MATCHES_REGEX"}},
+        fragment="id name",
+    )
+    for tag in tags:
+        tags_cache[tag["name"]] = tag["id"]
+    for name in plugin_tags:
+        if name not in tags_cache:
+            tags_cache[name] = stash.find_tag(name, create=True).get("id")
+    setSyncState(tags_state, tags_cache)
+
+
+def resolvePerformers(names):
+    """
+    Look up performer names not yet in performers_cache, batching them into a
+    few regex queries matching either the performer name or one of its aliases.
+    Every alias of a returned performer is cached too, so later lookups of
+    alternative names are free.
+    """
+    missing = []
+    for name in names:
+        key = name.lower()
+        if key and key not in performers_cache and key not in missing:
+            missing.append(key)
+    for i in range(0, len(missing), per_page):
+        batch = missing[i : i + per_page]
+        pattern = "(?i)^(%s)$" % (
+            "|".join(re.sub(r"([\\.+*?()|\[\]{}^$])", r"\\\1", n) for n in batch),
+        )
+        performers = stash.find_performers(
+            f={
+                "name": {"value": pattern, "modifier": "MATCHES_REGEX"},
+                "OR": {"aliases": {"value": pattern, "modifier": "MATCHES_REGEX"}},
+            },
+            fragment="id name alias_list",
+        )
+        log.debug(
+            "resolved %s performer names to %s performers"
+            % (
+                len(batch),
+                len(performers),
+            )
+        )
+        for name in batch:
+            performers_cache[name] = []
+        for perf in performers:
+            for name in [perf["name"]] + perf["alias_list"]:
+                ids = performers_cache.setdefault(name.lower(), [])
+                if perf["id"] not in ids:
+                    ids.append(perf["id"])
+
+
+def getPerformerIds(name):
+    if name.lower() not in performers_cache:
+        resolvePerformers([name])
+    return performers_cache.get(name.lower(), [])
+
+
 def processImages(img):
     log.debug("image: %s" % (img,))
     image_data = None
@@ -1226,9 +1448,63 @@ def db_migrations():
             "CREATE TABLE script_index (id INTEGER PRIMARY KEY, filename text,metadata text,scene_id text,md5 text);"
         )
         cur.execute("update schema_migrations set dirty=False where version=1")
+        funscript_schema = 1
+    if funscript_schema == 1:
+        cur.execute(
+            "insert into schema_migrations (version,start,dirty ) values (2,datetime('now'),true);"
+        )
+        cur.execute(
+            "CREATE TABLE sync_state (name text PRIMARY KEY, value text, updated timestamp);"
+        )
+        cur.execute("update schema_migrations set dirty=False where version=2")
+        con.commit()
+        funscript_schema = 2
+    if funscript_schema == 2:
+        cur.execute(
+            "insert into schema_migrations (version,start,dirty ) values (3,datetime('now'),true);"
+        )
+        cur.execute(
+            "CREATE TABLE submit_ledger (scene_id text PRIMARY KEY, hash text, submitted timestamp);"
+        )
+        cur.execute("update schema_migrations set dirty=False where version=3")
+        con.commit()
     return con
 
 
+def getSyncState(name, conn=None):
+    cur = (conn or db_migrations()).cursor()
+    res = cur.execute("select value from sync_state where name=?", (name,))
+    row = res.fetchone()
+    if not conn:
+        cur.connection.close()
+    if row:
+        return json.loads(row[0])
+    return None
+
+
+def clearSyncState(name, conn=None):
+    cur = (conn or db_migrations()).cursor()
+    cur.execute("delete from sync_state where name=?", (name,))
+    cur.connection.commit()
+    if not conn:
+        cur.connection.close()
+
+
+def setSyncState(name, value, conn=None):
+    """
+    Store value under name. Pass conn to reuse an open connection, like runJob
+    does for its per-item checkpoint, otherwise one is opened for the call.
+    """
+    cur = (conn or db_migrations()).cursor()
+    cur.execute(
+        "insert or replace into sync_state (name,value,updated) values (?,?,datetime('now'))",
+        (name, json.dumps(value)),
+    )
+    cur.connection.commit()
+    if not conn:
+        cur.connection.close()
+
+
 def funscript_index(path):
     conn = db_migrations()
     cur = conn.cursor()
@@ -1344,14 +1620,17 @@ settings["funscript_dbpath"] = (
     Path(res["systemStatus"]["databasePath"]).parent / "funscript_index.sqlite"
 )
 log.debug("settings: %s " % (settings,))
+tags_state = "tags:%s://%s:%s" % (
+    FRAGMENT_SERVER["Scheme"],
+    FRAGMENT_SERVER["Host"],
+    FRAGMENT_SERVER["Port"],
+)
 
 
 if "mode" in json_input["args"]:
     PLUGIN_ARGS = json_input["args"]["mode"]
     if "submitScene" == PLUGIN_ARGS:
-        skip_submit_tag_id = stash.find_tag(
-            "[Timestamp: Skip Submit]", create=True
-        ).get("id")
+        skip_submit_tag_id = getTag("[Timestamp: Skip Submit]")
         query = {
             "has_markers": "true",
             "tags": {
@@ -1363,9 +1642,7 @@ if "mode" in json_input["args"]:
         }
         submitScene(query)
     elif "submitMovieScene" == PLUGIN_ARGS:
-        skip_submit_tag_id = stash.find_tag(
-            "[Timestamp: Skip Submit]", create=True
-        ).get("id")
+        skip_submit_tag_id = getTag("[Timestamp: Skip Submit]")
         query = {
             "movies": {"modifier": "NOT_NULL", "value": []},
             "tags": {
@@ -1377,9 +1654,7 @@ if "mode" in json_input["args"]:
         }
         submitScene(query)
     elif "submitSLRScene" == PLUGIN_ARGS:
-        skip_submit_tag_id = stash.find_tag(
-            "[Timestamp: Skip Submit]", create=True
-        ).get("id")
+        skip_submit_tag_id = getTag("[Timestamp: Skip Submit]")
         query = {
             "tags": {
                 "depth": 0,
@@ -1391,9 +1666,7 @@ if "mode" in json_input["args"]:
         }
         submitScene(query)
     elif "submitEroscriptScene" == PLUGIN_ARGS:
-        skip_submit_tag_id = stash.find_tag(
-            "[Timestamp: Skip Submit]", create=True
-        ).get("id")
+        skip_submit_tag_id = getTag("[Timestamp: Skip Submit]")
         query = {
             "tags": {
                 "depth": 0,
@@ -1405,9 +1678,7 @@ if "mode" in json_input["args"]:
         }
         submitScene(query)
     elif "submitInteractiveScene" == PLUGIN_ARGS:
-        skip_submit_tag_id = stash.find_tag(
-            "[Timestamp: Skip Submit]", create=True
-        ).get("id")
+        skip_submit_tag_id = getTag("[Timestamp: Skip Submit]")
 
         query = {
             "tags": {
@@ -1430,9 +1701,7 @@ if "mode" in json_input["args"]:
         else:
             processGalleries()
     elif "processScene" == PLUGIN_ARGS:
-        skip_sync_tag_id = stash.find_tag("[Timestamp: Skip Sync]", create=True).get(
-            "id"
-        )
+        skip_sync_tag_id = getTag("[Timestamp: Skip Sync]")
         if "scene_id" in json_input["args"]:
             scene = stash.find_scene(json_input["args"]["scene_id"])
             processScene(scene)
@@ -1451,11 +1720,9 @@ if "mode" in json_input["args"]:
                     "value": [],
                 },
             }
-            processAll(query)
+            processAll(query, "processScene")
     elif "reprocessScene" == PLUGIN_ARGS:
-        skip_sync_tag_id = stash.find_tag("[Timestamp: Skip Sync]", create=True).get(
-            "id"
-        )
+        skip_sync_tag_id = getTag("[Timestamp: Skip Sync]")
         query = {
             "url": {"modifier": "INCLUDES", "value": "https://timestamp.trade/scene/"},
             "tags": {
@@ -1465,11 +1732,9 @@ if "mode" in json_input["args"]:
                 "value": [],
             },
         }
-        processAll(query)
+        processAll(query, "reprocessScene")
     elif "processAll" == PLUGIN_ARGS:
-        skip_sync_tag_id = stash.find_tag("[Timestamp: Skip Sync]", create=True).get(
-            "id"
-        )
+        skip_sync_tag_id = getTag("[Timestamp: Skip Sync]")
         query = {
             "stash_id_endpoint": {
                 "endpoint": "",
@@ -1483,7 +1748,12 @@ if "mode" in json_input["args"]:
                 "value": [],
             },
         }
-        processAll(query)
+        processAll(
+            query,
+            "processAll",
+            watermark="processAll",
+            full_resync=json_input["args"].get("fullResync", False),
+        )
     elif "reauto" == PLUGIN_ARGS:
         reDownloadGallery()
         stash.metadata_scan(paths=[settings["path"]])